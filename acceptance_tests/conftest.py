@@ -7,6 +7,7 @@
 import os
 import os.path
 import logging
+import email.utils
 import wsgiref.simple_server
 from threading import Thread
 import pytest
@@ -61,6 +62,8 @@ class DirServer(WSGIServer):
         super(DirServer, self).__init__(host, port, self)
         self.basepath = None
         self.num_requests = 0
+        self.num_bytes = 0
+        self.supports_range = True
 
     def __call__(self, environ, start_response):
         path_info = os.path.normpath(environ['PATH_INFO'])
@@ -76,13 +79,52 @@ class DirServer(WSGIServer):
                 start_response('200 OK', [('Content-Length', str(len(listing)))])
                 return [listing]
             except OSError:
-                start_response('200 OK', [('Content-Length', str(os.path.getsize(localpath)))])
+                st = os.stat(localpath)
+                etag = '"%x-%x-%x"' % (st.st_ino, st.st_size, int(st.st_mtime * 1000000))
+                last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+                validators = [('ETag', etag), ('Last-Modified', last_modified)]
+                if 'HTTP_IF_NONE_MATCH' in environ:
+                    not_modified = environ['HTTP_IF_NONE_MATCH'] == etag
+                elif 'HTTP_IF_MODIFIED_SINCE' in environ:
+                    since = email.utils.parsedate_tz(environ['HTTP_IF_MODIFIED_SINCE'])
+                    not_modified = (since is not None and
+                            int(st.st_mtime) <= email.utils.mktime_tz(since))
+                else:
+                    not_modified = False
+                if not_modified:
+                    start_response('304 Not Modified', validators)
+                    return []
+                byte_range = self._parse_range(environ.get('HTTP_RANGE'), st.st_size)
+                if byte_range is not None:
+                    start, end = byte_range
+                    with open(localpath, 'rb') as f:
+                        f.seek(start)
+                        content = f.read(end - start + 1)
+                    self.num_bytes += len(content)
+                    start_response('206 Partial Content', [
+                        ('Content-Length', str(len(content))),
+                        ('Content-Range', 'bytes %d-%d/%d' % (start, end, st.st_size)),
+                    ] + validators)
+                    return [content]
+                self.num_bytes += st.st_size
+                start_response('200 OK', [('Content-Length', str(st.st_size))] + validators)
                 return wsgiref.util.FileWrapper(open(localpath, 'rb'))
         else:
             start_response('405 Method Not Allowed', [])
             return []
 
 
+    def _parse_range(self, header, size):
+        # Only a single range of the form "bytes=start-end" is supported, 
+        # which is all rpmdeplint ever asks for.
+        if not self.supports_range or not header or not header.startswith('bytes='):
+            return None
+        start, end = header[len('bytes='):].split('-')
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+        return start, end
+
+
 @pytest.fixture
 def dir_server(request):
     """
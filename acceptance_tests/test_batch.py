@@ -0,0 +1,76 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import json
+import shutil
+import tempfile
+import rpmfluff
+from data_setup import run_rpmdeplint
+
+
+def test_checks_each_package_set_in_isolation(request, dir_server):
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    baserepo = rpmfluff.YumRepoBuild([p1])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p_older = rpmfluff.SimpleRpmBuild('a', '0.0', '1', ['i386'])
+    p_older.make()
+    p_requires = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p_requires.add_requires('c')
+    p_requires.make()
+    p_provides = rpmfluff.SimpleRpmBuild('c', '0.1', '1', ['i386'])
+    p_provides.make()
+    manifest_dir = tempfile.mkdtemp()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(manifest_dir)
+        for p in [p1, p_older, p_requires, p_provides]:
+            shutil.rmtree(p.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    package_sets = [
+        {'name': 'b-and-c', 'rpms': [p_requires.get_built_rpm('i386'),
+                p_provides.get_built_rpm('i386')]},
+        # c is not in this set, so it cannot satisfy b
+        {'name': 'b', 'rpms': [p_requires.get_built_rpm('i386')],
+                'checks': ['check-sat']},
+        {'name': 'a', 'rpms': [p_older.get_built_rpm('i386')],
+                'checks': ['check-upgrade']},
+    ]
+    manifest = os.path.join(manifest_dir, 'manifest.json')
+    with open(manifest, 'w') as f:
+        for package_set in package_sets:
+            f.write(json.dumps(package_set) + '\n')
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'batch', '--jobs=2',
+            '--repo=base,{}'.format(dir_server.url), manifest])
+    assert exitcode == 3
+    assert err == ''
+    records = [json.loads(line) for line in out.splitlines()]
+    assert records == [
+        {'name': 'b-and-c', 'status': 0, 'problems': {'check-sat': [],
+                'check-repoclosure': [], 'check-conflicts': [], 'check-upgrade': []}},
+        {'name': 'b', 'status': 3, 'problems': {'check-sat': [
+                'nothing provides c needed by b-0.1-1.i386']}},
+        {'name': 'a', 'status': 3, 'problems': {'check-upgrade': [
+                'a-0.0-1.i386 would be upgraded by a-0.1-1.i386 from repo base']}},
+    ]
+
+
+def test_reports_invalid_manifest(request, dir_server):
+    manifest_dir = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(manifest_dir))
+    manifest = os.path.join(manifest_dir, 'manifest.json')
+    with open(manifest, 'w') as f:
+        f.write('{"name": "a", "rpms": ["a.rpm"]}\n{"rpms": ["b.rpm"]}\n')
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'batch',
+            '--repo=base,{}'.format(dir_server.url), manifest])
+    assert exitcode == 1
+    assert out == ''
+    assert err == 'Invalid package set 2 in manifest: missing name\n'
@@ -8,6 +8,7 @@ import os
 import glob
 import time
 import shutil
+import pytest
 import rpmfluff
 from data_setup import run_rpmdeplint
 from rpmdeplint.repodata import cache_base_path
@@ -27,7 +28,8 @@ def expected_cache_path(repodir, suffix, old=False):
     return os.path.join(cache_base_path(), checksum[:1], checksum[1:])
 
 
-def test_finds_all_problems(request, dir_server):
+@pytest.mark.parametrize('extra_args', [[], ['--serial-checks']])
+def test_finds_all_problems(request, dir_server, extra_args):
     p_newer = rpmfluff.SimpleRpmBuild('a', '5.0', '1', ['i386'])
     p_with_content = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
     p_with_content.add_installed_file(installPath='usr/share/thing',
@@ -63,7 +65,7 @@ def test_finds_all_problems(request, dir_server):
 
     exitcode, out, err = run_rpmdeplint(
             ['rpmdeplint', 'check', '--repo=base,{}'.format(dir_server.url)] +
-            [p.get_built_rpm('i386') for p in test_packages])
+            extra_args + [p.get_built_rpm('i386') for p in test_packages])
     assert exitcode == 3
     assert err == ('Problems with dependency set:\n'
             'nothing provides doesnotexist needed by e-1.0-1.i386\n'
@@ -75,6 +77,42 @@ def test_finds_all_problems(request, dir_server):
             'a-4.0-1.i386 would be upgraded by a-5.0-1.i386 from repo base\n')
 
 
+def test_warnings_are_in_check_order(request, dir_server):
+    p_broken = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p_broken.add_requires('doesnotexist')
+    p_broken.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'content\n'))
+    baserepo = rpmfluff.YumRepoBuild([p_broken])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p_with_different_content = rpmfluff.SimpleRpmBuild('f', '0.1', '1', ['i386'])
+    p_with_different_content.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'different content\n'))
+    p_with_different_content.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p_broken.get_base_dir())
+        shutil.rmtree(p_with_different_content.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    warnings = []
+    for extra_args in [[], ['--serial-checks']]:
+        exitcode, out, err = run_rpmdeplint(
+                ['rpmdeplint', 'check', '--repo=base,{}'.format(dir_server.url),
+                 '--full-repoclosure', '--upgrade-engine=distupgrade'] +
+                extra_args + [p_with_different_content.get_built_rpm('i386')])
+        assert exitcode == 0, err
+        # Drop the timestamps
+        warnings.append([line.split(' WARNING ', 1)[1] for line in err.splitlines()])
+    assert warnings[0] == warnings[1]
+    assert [w.split(':', 1)[0] for w in warnings[0]] == [
+            'Ignoring pre-existing repoclosure problem',
+            'Ignoring conflict candidate b-0.1-1.i386 with pre-existing dependency problems',
+            'Upgrade candidate has pre-existing dependency problem']
+
+
 def test_guesses_arch_when_combined_with_noarch_package(request, dir_server):
     # A more realistic case is an archful package with a noarch subpackage,
     # but rpmfluff currently can't produce that.
@@ -145,6 +183,52 @@ def test_cache_is_used_when_available(request, dir_server):
     assert dir_server.num_requests == 4
 
 
+def test_fresh_repomd_is_used_without_any_requests(request, dir_server):
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    baserepo = rpmfluff.YumRepoBuild((p1,))
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check',
+            '--metadata-expire=1h', '--repo=base,{}'.format(dir_server.url),
+            p1.get_built_rpm('i386')])
+    assert exitcode == 0
+    assert dir_server.num_requests == 3
+
+    # The cached repomd.xml is less than an hour old, so the repo should not 
+    # be contacted at all this time.
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check',
+            '--metadata-expire=1h', '--repo=base,{}'.format(dir_server.url),
+            p1.get_built_rpm('i386')])
+    assert exitcode == 0
+    assert dir_server.num_requests == 3
+
+
+def test_only_primary_is_downloaded_for_check_sat(request, dir_server):
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    baserepo = rpmfluff.YumRepoBuild((p1,))
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-sat',
+            '--repo=base,{}'.format(dir_server.url), p1.get_built_rpm('i386')])
+    assert exitcode == 0
+    # Only repomd.xml and primary.xml.gz
+    assert dir_server.num_requests == 2
+    assert os.path.exists(expected_cache_path(baserepo.repoDir, 'primary.xml.gz'))
+    assert not os.path.exists(expected_cache_path(baserepo.repoDir, 'filelists.xml.gz'))
+
+
 def test_cache_doesnt_grow_unboundedly(request, dir_server):
     os.environ['RPMDEPLINT_EXPIRY_SECONDS'] = '1'
 
@@ -5,11 +5,15 @@
 # (at your option) any later version.
 
 import shutil
+import base64
+import hashlib
 import subprocess
 import rpm
 import rpmfluff
+import os
 import os.path
 from data_setup import run_rpmdeplint
+from rpmdeplint.repodata import cache_entry_path
 
 
 def test_finds_undeclared_file_conflict(request, dir_server):
@@ -39,6 +43,176 @@ def test_finds_undeclared_file_conflict(request, dir_server):
             'a-0.1-1.i386 provides /usr/share/thing which is also provided by b-0.1-1.i386\n')
 
 
+def test_downloaded_packages_are_cached(request, dir_server):
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'content\n'))
+    baserepo = rpmfluff.YumRepoBuild([p2])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'different content\n'))
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    args = ['rpmdeplint', 'check-conflicts', '--repo=base,{}'.format(dir_server.url),
+            p1.get_built_rpm('i386')]
+    exitcode, out, err = run_rpmdeplint(args)
+    assert exitcode == 3
+    # repomd.xml, primary.xml.gz, filelists.xml.gz and the package
+    assert dir_server.num_requests == 4
+
+    exitcode, out, err = run_rpmdeplint(args)
+    assert exitcode == 3
+    assert err == ('Undeclared file conflicts:\n'
+            'a-0.1-1.i386 provides /usr/share/thing which is also provided by b-0.1-1.i386\n')
+    # Only repomd.xml is requested again
+    assert dir_server.num_requests == 5
+
+
+def test_only_header_is_downloaded_for_large_package(request, dir_server):
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'content\n'))
+    # Random data so that the payload does not compress
+    p2.add_installed_file(installPath='usr/share/b/firmware',
+            sourceFile=rpmfluff.SourceFile('firmware',
+                base64.b64encode(os.urandom(2 * 1024 * 1024)).decode('ascii')))
+    baserepo = rpmfluff.YumRepoBuild([p2])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'different content\n'))
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-conflicts',
+                                         '--repo=base,{}'.format(dir_server.url),
+                                         p1.get_built_rpm('i386')])
+    assert exitcode == 3
+    assert err == ('Undeclared file conflicts:\n'
+            'a-0.1-1.i386 provides /usr/share/thing which is also provided by b-0.1-1.i386\n')
+    package_size = os.path.getsize(p2.get_built_rpm('i386'))
+    assert package_size > 2 * 1024 * 1024
+    assert dir_server.num_bytes < package_size / 10
+
+
+def test_whole_package_is_downloaded_if_server_ignores_range(request, dir_server):
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'content\n'))
+    baserepo = rpmfluff.YumRepoBuild([p2])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+    dir_server.supports_range = False
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'different content\n'))
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-conflicts',
+                                         '--repo=base,{}'.format(dir_server.url),
+                                         p1.get_built_rpm('i386')])
+    assert exitcode == 3
+    assert err == ('Undeclared file conflicts:\n'
+            'a-0.1-1.i386 provides /usr/share/thing which is also provided by b-0.1-1.i386\n')
+    with open(p2.get_built_rpm('i386'), 'rb') as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    assert os.path.isfile(cache_entry_path(checksum))
+
+
+def test_stored_file_attributes_are_used_instead_of_header(request, dir_server):
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'content\n'))
+    p2.add_installed_file(installPath='usr/share/same',
+            sourceFile=rpmfluff.SourceFile('same', 'same content\n'))
+    baserepo = rpmfluff.YumRepoBuild([p2])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.add_installed_file(installPath='usr/share/thing',
+            sourceFile=rpmfluff.SourceFile('thing', 'different content\n'))
+    p1.add_installed_file(installPath='usr/share/same',
+            sourceFile=rpmfluff.SourceFile('same', 'same content\n'))
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    args = ['rpmdeplint', 'check-conflicts', '--repo=base,{}'.format(dir_server.url),
+            p1.get_built_rpm('i386')]
+    expected_err = ('Undeclared file conflicts:\n'
+            'a-0.1-1.i386 provides /usr/share/thing which is also provided by b-0.1-1.i386\n')
+    exitcode, out, err = run_rpmdeplint(args)
+    assert exitcode == 3
+    assert err == expected_err
+
+    with open(p2.get_built_rpm('i386'), 'rb') as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    os.unlink(cache_entry_path(checksum) + '.hdr')
+    num_requests = dir_server.num_requests
+    exitcode, out, err = run_rpmdeplint(args)
+    assert exitcode == 3
+    assert err == expected_err
+    # Only repomd.xml is requested, the header is not needed again
+    assert dir_server.num_requests == num_requests + 1
+
+
+def test_shared_directory_is_not_downloaded(request, dir_server):
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_installed_directory(installPath='usr/share/things')
+    p2.add_installed_file(installPath='usr/share/things/b',
+            sourceFile=rpmfluff.SourceFile('b', 'b\n'))
+    baserepo = rpmfluff.YumRepoBuild([p2])
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.add_installed_directory(installPath='usr/share/things')
+    p1.add_installed_file(installPath='usr/share/things/a',
+            sourceFile=rpmfluff.SourceFile('a', 'a\n'))
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-conflicts',
+                                         '--repo=base,{}'.format(dir_server.url),
+                                         p1.get_built_rpm('i386')])
+    assert exitcode == 0
+    # repomd.xml, primary.xml.gz and filelists.xml.gz, but not the package
+    assert dir_server.num_requests == 3
+
+
 def test_finds_undeclared_file_conflict_with_repo_on_local_filesystem(request):
     p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
     p2.add_installed_file(installPath='usr/share/thing',
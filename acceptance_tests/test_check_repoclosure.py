@@ -184,6 +184,7 @@ def test_warns_on_preexisting_repoclosure_problems(request, dir_server):
     request.addfinalizer(cleanUp)
 
     exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-repoclosure',
+                                         '--full-repoclosure',
                                          '--repo=base,{}'.format(dir_server.url),
                                          p1.get_built_rpm('i386')])
     assert exitcode == 0
@@ -191,6 +192,31 @@ def test_warns_on_preexisting_repoclosure_problems(request, dir_server):
             'nothing provides doesnotexist needed by b-0.1-1.i386\n' in err)
 
 
+def test_skips_packages_unaffected_by_packages_under_test(request, dir_server):
+    # By default only packages which need something replaced by the packages 
+    # under test are checked, so the pre-existing problem is not even seen.
+    p2 = rpmfluff.SimpleRpmBuild('b', '0.1', '1', ['i386'])
+    p2.add_requires('doesnotexist')
+    baserepo = rpmfluff.YumRepoBuild((p2,))
+    baserepo.make('i386')
+    dir_server.basepath = baserepo.repoDir
+
+    p1 = rpmfluff.SimpleRpmBuild('a', '0.1', '1', ['i386'])
+    p1.make()
+
+    def cleanUp():
+        shutil.rmtree(baserepo.repoDir)
+        shutil.rmtree(p2.get_base_dir())
+        shutil.rmtree(p1.get_base_dir())
+    request.addfinalizer(cleanUp)
+
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'check-repoclosure',
+                                         '--repo=base,{}'.format(dir_server.url),
+                                         p1.get_built_rpm('i386')])
+    assert exitcode == 0
+    assert err == ''
+
+
 def test_works_on_different_platform_to_current(request, dir_server):
     grep = rpmfluff.SimpleRpmBuild('grep', '2.20', '3.el6', ['ppc64'])
 
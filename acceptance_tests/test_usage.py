@@ -23,3 +23,10 @@ def test_prints_usage_when_no_repos_are_defined():
     assert 'usage:' in err
     assert 'error: no repos specified to test against' in err
     assert exitcode == 2
+
+
+def test_cache_subcommand_does_not_require_repos():
+    exitcode, out, err = run_rpmdeplint(['rpmdeplint', 'cache', 'stats'])
+    assert exitcode == 0
+    assert 'Total: ' in out
+    assert err == ''
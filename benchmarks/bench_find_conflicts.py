@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Compares the cost of finding file conflict candidates with the old pairwise 
+scan of every solvable's file list, against a single pass building a file 
+index (as used by find_conflicts), on synthetic pools of increasing size.
+
+Run from the top of the source tree:
+
+    python benchmarks/bench_find_conflicts.py
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+import argparse
+import solv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from rpmdeplint import _build_file_index
+
+
+def add_package(repo, data, name, paths):
+    pool = repo.pool
+    solvable = repo.add_solvable()
+    solvable.name = name
+    solvable.evr = '1-1'
+    solvable.arch = 'noarch'
+    solvable.add_deparray(solv.SOLVABLE_PROVIDES,
+            pool.rel2id(solvable.nameid, solvable.evrid, solv.REL_EQ))
+    for path in paths:
+        dirname, basename = path.rsplit('/', 1)
+        data.add_dirstr(solvable.id, solv.SOLVABLE_FILELIST,
+                data.str2dir(dirname), basename)
+    return solvable
+
+
+def make_pool(num_packages, files_per_package, num_test_packages):
+    pool = solv.Pool()
+    pool.setarch('x86_64')
+    repo = pool.add_repo('base')
+    data = repo.add_repodata()
+    for i in range(num_packages):
+        paths = ['/usr/share/pkg%d/file%d' % (i, j) for j in range(files_per_package)]
+        # Some directories are shared by many packages
+        paths.append('/usr/share/licenses/pkg%d' % i)
+        add_package(repo, data, 'pkg%d' % i, paths)
+    data.internalize()
+    test_repo = pool.add_repo('@commandline')
+    test_data = test_repo.add_repodata()
+    test_solvables = []
+    for i in range(num_test_packages):
+        # Each test package overlaps with one file from some base package
+        paths = ['/usr/share/test%d/file%d' % (i, j) for j in range(files_per_package)]
+        paths.append('/usr/share/pkg%d/file0' % (i * 7 % num_packages))
+        test_solvables.append(add_package(test_repo, test_data, 'test%d' % i, paths))
+    test_data.internalize()
+    pool.createwhatprovides()
+    return pool, test_solvables
+
+
+def files_in_solvable(pool, solvable):
+    iterator = solvable.Dataiterator(pool.str2id('solvable:filelist'), None,
+            solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
+    return [match.str for match in iterator]
+
+
+def pairwise_candidates(pool, test_solvables):
+    candidates = set()
+    for solvable in test_solvables:
+        filenames = set(files_in_solvable(pool, solvable))
+        for conflicting in pool.solvables:
+            if conflicting == solvable:
+                continue
+            if filenames.intersection(files_in_solvable(pool, conflicting)):
+                candidates.add((solvable.id, conflicting.id))
+    return candidates
+
+
+def indexed_candidates(pool, test_solvables):
+    candidates = set()
+    paths = set()
+    for solvable in test_solvables:
+        paths.update(files_in_solvable(pool, solvable))
+    index = _build_file_index(pool, paths)
+    for solvable in test_solvables:
+        for filename in files_in_solvable(pool, solvable):
+            for solvid in index.get(filename, ()):
+                if solvid != solvable.id:
+                    candidates.add((solvable.id, solvid))
+    return candidates
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files-per-package', type=int, default=20)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--test-packages', type=int, nargs='+', default=[1, 10, 40])
+    args = parser.parse_args()
+
+    print('%10s %8s %12s %12s' % ('pool size', 'tests', 'pairwise (s)', 'indexed (s)'))
+    for num_packages in args.sizes:
+        for num_test_packages in args.test_packages:
+            pool, test_solvables = make_pool(num_packages, args.files_per_package,
+                    num_test_packages)
+            pairwise_time, pairwise = timed(pairwise_candidates, pool, test_solvables)
+            indexed_time, indexed = timed(indexed_candidates, pool, test_solvables)
+            assert pairwise == indexed
+            print('%10d %8d %12.3f %12.3f'
+                    % (num_packages, num_test_packages, pairwise_time, indexed_time))
+
+
+if __name__ == '__main__':
+    main()
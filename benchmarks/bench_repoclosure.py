@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Compares the "single" and "bulk" repoclosure engines on synthetic repos of 
+increasing size, where a small fraction of packages have problems.
+
+Run from the top of the source tree:
+
+    python benchmarks/bench_repoclosure.py
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+import argparse
+import logging
+import solv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from rpmdeplint import DependencyAnalyzer
+
+
+def add_package(repo, name, provides=(), requires=(), conflicts=()):
+    pool = repo.pool
+    solvable = repo.add_solvable()
+    solvable.name = name
+    solvable.evr = '1-1'
+    solvable.arch = 'noarch'
+    solvable.add_deparray(solv.SOLVABLE_PROVIDES,
+            pool.rel2id(solvable.nameid, solvable.evrid, solv.REL_EQ))
+    for dep in provides:
+        solvable.add_deparray(solv.SOLVABLE_PROVIDES, pool.str2id(dep))
+    for dep in requires:
+        solvable.add_deparray(solv.SOLVABLE_REQUIRES, pool.str2id(dep))
+    for dep in conflicts:
+        solvable.add_deparray(solv.SOLVABLE_CONFLICTS, pool.str2id(dep))
+
+
+def make_analyzer(num_packages):
+    analyzer = DependencyAnalyzer(repos=[], packages=[], arch='x86_64')
+    repo = analyzer.pool.add_repo('synthetic')
+    num_libs = max(1, num_packages // 20)
+    for i in range(num_libs):
+        add_package(repo, 'lib%d' % i, provides=['lib%d.so' % i],
+                requires=['lib%d.so' % (i // 2)] if i else [])
+    for i in range(num_packages):
+        requires = ['lib%d.so' % (i % num_libs), 'lib%d.so' % ((i * 7) % num_libs)]
+        if i % 100 == 0:
+            requires.append('doesnotexist')
+        conflicts = ['app%d' % (i + 1)] if i % 50 == 1 else []
+        add_package(repo, 'app%d' % i, requires=requires, conflicts=conflicts)
+    repo.internalize()
+    analyzer.pool.createwhatprovides()
+    return analyzer
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+    args = parser.parse_args()
+    # Pre-existing problems would be warned about for every run
+    logging.getLogger('rpmdeplint').setLevel(logging.ERROR)
+
+    # Keep the cached repoclosure baseline from helping later runs
+    cache_home = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = cache_home
+    try:
+        print('%10s %12s %12s' % ('pool size', 'single (s)', 'bulk (s)'))
+        for num_packages in args.sizes:
+            times = []
+            results = []
+            for engine in ['single', 'bulk']:
+                shutil.rmtree(os.path.join(cache_home, 'rpmdeplint'), ignore_errors=True)
+                analyzer = make_analyzer(num_packages)
+                elapsed, problems = timed(analyzer.find_repoclosure_problems,
+                        full=True, engine=engine)
+                times.append(elapsed)
+                results.append(problems)
+            assert results[0] == results[1]
+            print('%10d %12.3f %12.3f' % (num_packages, times[0], times[1]))
+    finally:
+        shutil.rmtree(cache_home)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Measures how long rpmdeplint takes to start up, for commands which do not 
+load any repos, and lists the slow modules imported at startup (there should 
+be none).
+
+Run from the top of the source tree:
+
+    python benchmarks/bench_startup.py
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import subprocess
+import time
+import argparse
+
+top = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [top] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+
+#: Modules which are slow to import, and only needed once repos are loaded
+slow_modules = ['pkg_resources', 'requests', 'librepo', 'solv', 'rpm',
+        'ctypes', 'dnf', 'yum']
+
+commands = [
+    ('import', ['-c', 'import rpmdeplint.cli']),
+    ('--help', ['-c', 'import sys; from rpmdeplint.cli import main; '
+                      'sys.argv = ["rpmdeplint", "--help"]; main()']),
+    ('usage error', ['-c', 'import sys; from rpmdeplint.cli import main; '
+                           'sys.argv = ["rpmdeplint", "check-sat"]; main()']),
+]
+
+
+def time_command(args, runs):
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call([sys.executable] + args, stdout=devnull,
+                    stderr=devnull, env=env)
+            times.append(time.time() - start)
+    return sorted(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=20,
+            help='Number of times to run each command [default: 20]')
+    args = parser.parse_args()
+
+    code = ('import sys, rpmdeplint.cli; '
+            'sys.stdout.write(" ".join(sorted(name for name in %r '
+            'if name in sys.modules)))' % slow_modules)
+    imported = subprocess.check_output([sys.executable, '-c', code],
+            env=env).decode('ascii')
+    print('Slow modules imported at startup: %s' % (imported or 'none'))
+
+    baseline = time_command(['-c', 'pass'], args.runs)
+    print('%-12s %10s %10s' % ('command', 'min (ms)', 'median (ms)'))
+    print('%-12s %10.1f %10.1f' % ('python', baseline[0] * 1000,
+            baseline[len(baseline) // 2] * 1000))
+    for name, command_args in commands:
+        times = time_command(command_args, args.runs)
+        print('%-12s %10.1f %10.1f' % (name, times[0] * 1000,
+                times[len(times) // 2] * 1000))
+    return 1 if imported else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,19 +7,51 @@
 from __future__ import absolute_import
 
 import os, os.path
-from collections import defaultdict
+import posixpath
+from array import array
+import bisect
+from collections import defaultdict, namedtuple, OrderedDict
+import functools
+import importlib
+import copy
 import binascii
+import errno
+import hashlib
+import json
 import logging
+import mmap
+import stat
+import struct
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import six
 from six.moves import map
-import solv
-import rpm
-import ctypes
 
 
 logger = logging.getLogger(__name__)
 
 
+class _LazyModule(object):
+    """
+    Stands in for a module which is slow to import, importing it when it is 
+    first used. The module then replaces this object in the globals of this 
+    module, so that only the first use costs anything. This keeps commands 
+    which do not load any repos, and ``--help``, quick to start.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+
+solv = _LazyModule('solv')
+rpm = _LazyModule('rpm')
+
+
 installonlypkgs = [
     # The default 'installonlypkgs' from dnf
     # https://github.com/rpm-software-management/dnf/blob/dnf-2.5.1-1/dnf/const.py.in#L28
@@ -41,6 +73,503 @@ installonlypkgs = [
     'kernel-PAE-debug',
 ]
 
+# Dependencies which may name a file, and so need file provides
+_file_dependency_keynames = [
+    'solvable:requires',
+    'solvable:conflicts',
+    'solvable:obsoletes',
+    'solvable:recommends',
+    'solvable:suggests',
+    'solvable:supplements',
+    'solvable:enhances',
+]
+
+
+def _libsolv_version():
+    """
+    Returns a string identifying the libsolv build in use, so that cached solv 
+    files written by one version of libsolv are not loaded by another.
+    """
+    version = getattr(solv, 'VERSION', None)
+    if version:
+        return version
+    # Older bindings do not expose the version, so identify the extension 
+    # module binary itself instead.
+    extension = getattr(solv, '_solv', solv)
+    path = getattr(extension, '__file__', solv.__file__)
+    st = os.stat(path)
+    return '%s:%d:%d' % (path, st.st_size, st.st_mtime)
+
+
+def _solv_cache_checksum(kind, *checksums):
+    """
+    Returns the key under which a solv file of the given kind ("primary", or 
+    the "filelists" extension), parsed from the repodata files with the given 
+    checksums, is stored in the rpmdeplint cache. Other data derived from the 
+    solv files (the "fileindex") is keyed in the same way.
+    """
+    h = hashlib.sha256()
+    h.update(b'solv\0' + _libsolv_version().encode('utf8'))
+    h.update(b'\0' + kind.encode('ascii'))
+    for checksum in checksums:
+        h.update(b'\0' + checksum.encode('ascii'))
+    return h.hexdigest()
+
+
+def _download_repodata(repo, load_filelists=False):
+    """
+    Downloads repodata for the given repo, in a worker thread. Returns a tuple 
+    of (repo, RepoDownloadError or None) so that the caller can decide whether 
+    the error should be fatal.
+    """
+    # delayed import to avoid circular dependency
+    from rpmdeplint.repodata import RepoDownloadError
+    try:
+        repo.download_repodata()
+        if load_filelists:
+            repo.filelists
+    except RepoDownloadError as e:
+        return repo, e
+    return repo, None
+
+
+#: Attributes of a file in an RPM package, which rpm compares when deciding 
+#: whether two packages may both contain the same file
+_FileAttributes = namedtuple('_FileAttributes', ['digest', 'digestalgo', 'mode',
+        'flags', 'user', 'group', 'link', 'rdev', 'color'])
+
+
+def _text(value):
+    if isinstance(value, six.text_type):
+        return value
+    return value.decode('utf8', 'replace')
+
+
+def _header_strings(hdr, tag):
+    values = hdr[tag] or []
+    # Depending on the rpm version, string tags are bytes on Python 3
+    return [v.decode('utf8', 'replace') if isinstance(v, bytes) and not isinstance(v, str)
+            else v for v in values]
+
+
+def _file_attributes_from_header(hdr):
+    """
+    Returns a dict of {path: :py:class:`_FileAttributes`} for every file in 
+    the given package header.
+    """
+    filenames = _header_strings(hdr, rpm.RPMTAG_FILENAMES)
+    if not filenames:
+        return {}
+    # Packages built before file digest algorithms were configurable use MD5
+    digestalgo = hdr[rpm.RPMTAG_FILEDIGESTALGO] or 1
+    attributes = zip(_header_strings(hdr, rpm.RPMTAG_FILEDIGESTS),
+            hdr[rpm.RPMTAG_FILEMODES], hdr[rpm.RPMTAG_FILEFLAGS],
+            _header_strings(hdr, rpm.RPMTAG_FILEUSERNAME),
+            _header_strings(hdr, rpm.RPMTAG_FILEGROUPNAME),
+            _header_strings(hdr, rpm.RPMTAG_FILELINKTOS),
+            hdr[rpm.RPMTAG_FILERDEVS],
+            hdr[rpm.RPMTAG_FILECOLORS] or [0] * len(filenames))
+    return dict((filename, _FileAttributes(digest or None, digestalgo, mode & 0xffff,
+                flags, user, group, link or None, rdev & 0xffff, color))
+            for filename, (digest, mode, flags, user, group, link, rdev, color)
+            in zip(filenames, attributes))
+
+
+def _file_attributes_match(a, b):
+    """
+    Returns True if rpm considers the two files identical, so that two 
+    packages may both contain them. This follows rpmfilesCompare().
+    """
+    if (a.flags & rpm.RPMFILE_GHOST) or (b.flags & rpm.RPMFILE_GHOST):
+        return True
+    # Mode difference is a conflict, except for symlinks
+    if not (stat.S_ISLNK(a.mode) and stat.S_ISLNK(b.mode)) and a.mode != b.mode:
+        return False
+    if stat.S_ISLNK(a.mode) or stat.S_ISREG(a.mode):
+        if a.user != b.user or a.group != b.group:
+            return False
+    if stat.S_ISLNK(a.mode):
+        return a.link == b.link
+    if stat.S_ISREG(a.mode):
+        # Digests made with different algorithms cannot be compared
+        return a.digestalgo == b.digestalgo and a.digest == b.digest
+    if stat.S_ISCHR(a.mode) or stat.S_ISBLK(a.mode):
+        return a.rdev == b.rdev
+    return True
+
+
+def _build_file_index(source, paths):
+    """
+    Returns a dict of {path: list of solvable ids} for every solvable in the 
+    source (a pool, or a single repo) which contains any of the given paths, 
+    in a single pass over the file lists of the whole source.
+    """
+    index = defaultdict(list)
+    pool = getattr(source, 'pool', source)
+    iterator = source.Dataiterator(pool.str2id('solvable:filelist'), None,
+            solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
+    for match in iterator:
+        path = match.str
+        if path in paths:
+            index[path].append(match.solvid)
+    return dict(index)
+
+
+def _path_hash(path):
+    """
+    Returns a hash of a file path, with the number of bits used by 
+    :py:class:`_MappedFileIndex`.
+    """
+    if isinstance(path, six.text_type):
+        path = path.encode('utf8')
+    digest = hashlib.md5(path).digest()
+    return struct.unpack('<Q', digest[:8])[0] >> _MappedFileIndex.position_bits
+
+
+class _MappedFileIndex(object):
+    """
+    Read-only index of the file paths in a repo, stored in the rpmdeplint 
+    cache. It is memory-mapped rather than read, so opening it costs almost 
+    nothing and its pages are shared by concurrent processes using the same 
+    repos.
+
+    The file is a header followed by a sorted array of little-endian 64-bit 
+    records. The top bits of each record are a hash of a path, and the bottom 
+    *position_bits* bits are the position in the repo of a solvable which 
+    contains that path. Hashes can collide, so callers must check that the 
+    candidates really contain the path.
+
+    Like a dict from :py:func:`_build_file_index`, :py:meth:`get` returns 
+    solvable ids for a path.
+    """
+
+    magic = b'RDFIDX01'
+    header = struct.Struct('<8sII') # magic, number of solvables, number of records
+    record = struct.Struct('<Q')
+    position_bits = 24
+
+    def __init__(self, path, solv_repo):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < self.header.size:
+                raise ValueError('Truncated file index %s' % path)
+            magic, nsolvables, self._len = self.header.unpack_from(self._mmap, 0)
+            if magic != self.magic:
+                raise ValueError('Bad magic in file index %s' % path)
+            if len(self._mmap) != self.header.size + self._len * self.record.size:
+                raise ValueError('Truncated file index %s' % path)
+            if nsolvables != solv_repo.nsolvables:
+                raise ValueError('File index %s is for %d solvables, not %d'
+                        % (path, nsolvables, solv_repo.nsolvables))
+        except ValueError:
+            self._mmap.close()
+            raise
+        self._solvids = None
+        self._solv_repo = solv_repo
+
+    @classmethod
+    def write(cls, f, solv_repo):
+        """
+        Writes an index of the paths in all file lists of the given repo to 
+        the open file *f*. Returns False if the repo is too large to index.
+        """
+        if solv_repo.nsolvables >= 1 << cls.position_bits:
+            return False
+        positions = dict((solvable.id, position) for position, solvable
+                in enumerate(solv_repo.solvables_iter()))
+        # Not an array, because Python 2 has no 64-bit array typecode
+        records = []
+        iterator = solv_repo.Dataiterator(solv_repo.pool.str2id('solvable:filelist'), None,
+                solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
+        for match in iterator:
+            records.append((_path_hash(match.str) << cls.position_bits)
+                    | positions[match.solvid])
+        records.sort()
+        f.write(cls.header.pack(cls.magic, solv_repo.nsolvables, len(records)))
+        f.write(struct.pack('<%dQ' % len(records), *records))
+        return True
+
+    # The records are exposed as a sequence, for bisect
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        return self.record.unpack_from(self._mmap,
+                self.header.size + i * self.record.size)[0]
+
+    def get(self, path, default=None):
+        if self._solvids is None:
+            self._solvids = [solvable.id for solvable in self._solv_repo.solvables_iter()]
+        key = _path_hash(path)
+        mask = (1 << self.position_bits) - 1
+        solvids = []
+        i = bisect.bisect_left(self, key << self.position_bits)
+        while i < self._len:
+            record = self[i]
+            if record >> self.position_bits != key:
+                break
+            solvids.append(self._solvids[record & mask])
+            i += 1
+        return solvids or default
+
+    def close(self):
+        self._mmap.close()
+
+
+#: ctypes libraries for rpm < 4.12, see _rpm411_bindings()
+_rpm411 = None
+
+
+def _rpm411_bindings():
+    """
+    Returns a tuple of (librpm, _rpm) ctypes libraries, for calling rpm C APIs 
+    which rpm < 4.12 does not expose in its Python bindings. They are loaded 
+    once per process.
+    """
+    global _rpm411
+    if _rpm411 is None:
+        import ctypes
+        librpm = ctypes.CDLL('librpm.so.3')
+        _rpm = ctypes.CDLL(os.path.join(os.path.dirname(rpm.__file__), '_rpm.so'))
+        class rpmfi_s(ctypes.Structure): pass
+        librpm.rpmfiCompare.argtypes = [ctypes.POINTER(rpmfi_s), ctypes.POINTER(rpmfi_s)]
+        librpm.rpmfiCompare.restype = ctypes.c_int
+        librpm.rpmfiSetFX.argtypes = [ctypes.POINTER(rpmfi_s), ctypes.c_int]
+        librpm.rpmfiSetFX.restype = ctypes.c_int
+        _rpm.fiFromFi.argtypes = [ctypes.py_object]
+        _rpm.fiFromFi.restype = ctypes.POINTER(rpmfi_s)
+        _rpm411 = (librpm, _rpm)
+    return _rpm411
+
+
+#: State inherited by forked worker processes, see 
+#: DependencyAnalyzer._map_in_forked_workers()
+_worker_state = None
+
+
+def _call_in_worker(index):
+    func, solvids, pool = _worker_state
+    return func(pool.solvables[solvids[index]])
+
+
+class _SolvableIdSet(object):
+    """
+    Set of solvables in a pool, stored as a bitmap indexed by solvable id, so 
+    that testing membership does not depend on the size of the set.
+    """
+
+    def __init__(self, pool, size):
+        self.pool = pool
+        self._bits = bytearray((size + 7) // 8)
+
+    def add(self, solvid):
+        self._bits[solvid >> 3] |= 1 << (solvid & 7)
+
+    def update(self, other):
+        for i, byte in enumerate(other._bits):
+            self._bits[i] |= byte
+
+    def __contains__(self, solvable):
+        solvid = getattr(solvable, 'id', solvable)
+        return (solvid >> 3 < len(self._bits)
+                and bool(self._bits[solvid >> 3] & (1 << (solvid & 7))))
+
+    def ids(self):
+        ids = []
+        for i, byte in enumerate(self._bits):
+            if byte:
+                ids.extend((i << 3) + bit for bit in range(8) if byte & (1 << bit))
+        return ids
+
+    def __len__(self):
+        return len(self.ids())
+
+    def solvables(self):
+        return [self.pool.solvables[solvid] for solvid in self.ids()]
+
+    def jobs(self, how):
+        """
+        Returns a list of jobs applying *how* to every solvable in the set, 
+        like :py:meth:`solv.Selection.jobs`. The set is passed to the solver 
+        as a single job, however many solvables it has.
+        """
+        ids = self.ids()
+        if not ids:
+            return []
+        return [self.pool.Job(solv.Job.SOLVER_SOLVABLE_ONE_OF | how,
+                self.pool.towhatprovides(ids))]
+
+
+class _SolvableTable(object):
+    """
+    Columns of the name, arch and EVR of every solvable in a pool, for 
+    working out which solvables are upgraded or obsoleted by others without 
+    building and parsing a selection for each one.
+
+    Solvables are grouped by name and arch. Each is given a rank, its 
+    position in its group ordered by EVR (equal EVRs have equal ranks), so 
+    that comparing EVRs within a group is comparing two integers. The 
+    columns are arrays indexed by solvable id.
+    """
+
+    def __init__(self, pool, solvables):
+        self.pool = pool
+        solvables = list(solvables)
+        self.size = max([s.id for s in solvables] + [0]) + 1
+        #: Group of each solvable
+        self.group = array('i', [-1]) * self.size
+        #: Rank of each solvable within its group
+        self.rank = array('i', [0]) * self.size
+        #: Solvable ids in each group, and their ranks, ordered by rank
+        self.group_ids = []
+        self.group_ranks = []
+        #: Groups with each name id, for every arch
+        self.groups_by_name = {}
+        self._groups_by_name_arch = {}
+        self._add(solvables)
+
+    def _add(self, solvables):
+        members_by_group = defaultdict(list)
+        for solvable in solvables:
+            key = (solvable.nameid, solvable.archid)
+            group = self._groups_by_name_arch.get(key)
+            if group is None:
+                group = self._groups_by_name_arch[key] = len(self.group_ids)
+                self.group_ids.append(array('i'))
+                self.group_ranks.append(array('i'))
+                self.groups_by_name[solvable.nameid] = \
+                        self.groups_by_name.get(solvable.nameid, []) + [group]
+                members_by_group[group] = []
+            elif group not in members_by_group:
+                members_by_group[group] = [self.pool.solvables[solvid]
+                        for solvid in self.group_ids[group]]
+            members_by_group[group].append(solvable)
+        evr_key = functools.cmp_to_key(lambda a, b: a.evrcmp(b))
+        for group, members in members_by_group.items():
+            if len(members) > 1:
+                members.sort(key=evr_key)
+            ids = array('i')
+            ranks = array('i')
+            rank = 0
+            for i, solvable in enumerate(members):
+                if i and solvable.evrid != members[i - 1].evrid \
+                        and solvable.evrcmp(members[i - 1]) != 0:
+                    rank = i
+                self.group[solvable.id] = group
+                self.rank[solvable.id] = rank
+                ids.append(solvable.id)
+                ranks.append(rank)
+            self.group_ids[group] = ids
+            self.group_ranks[group] = ranks
+
+    def extended(self, solvables):
+        """
+        Returns a copy of this table with the given solvables, which must not 
+        be in it already, added as well. Only the groups they join are ranked 
+        again, so this is much cheaper than building a new table.
+        """
+        solvables = list(solvables)
+        table = copy.copy(self)
+        table.size = max([self.size] + [s.id + 1 for s in solvables])
+        table.group = self.group + array('i', [-1]) * (table.size - self.size)
+        table.rank = self.rank + array('i', [0]) * (table.size - self.size)
+        table.group_ids = list(self.group_ids)
+        table.group_ranks = list(self.group_ranks)
+        table.groups_by_name = dict(self.groups_by_name)
+        table._groups_by_name_arch = dict(self._groups_by_name_arch)
+        table._add(solvables)
+        return table
+
+    def obsoleted_by(self, solvables):
+        """
+        Returns a :py:class:`_SolvableIdSet` of every solvable which is 
+        "obsoleted" by some solvable in the given iterable -- either due to an 
+        explicit Obsoletes relationship, or because it has the same name and 
+        arch as the other solvable with a lower epoch-version-release.
+        """
+        obsoleted = _SolvableIdSet(self.pool, self.size)
+        obsoletes = self.pool.str2id('solvable:obsoletes')
+        # Only the highest ranked of the given solvables in each group matters
+        highest = {}
+        for solvable in solvables:
+            group = self.group[solvable.id]
+            if self.rank[solvable.id] > highest.get(group, 0):
+                highest[group] = self.rank[solvable.id]
+            for obsoletes_rel in solvable.lookup_deparray(obsoletes):
+                # Every solvable matching the obsoletes relationship by name
+                for other in obsoletes_rel.Selection_name().solvables():
+                    obsoleted.add(other.id)
+        # XXX are there some special cases with arch-noarch upgrades which this does not handle?
+        for group, rank in highest.items():
+            ids = self.group_ids[group]
+            for i in range(bisect.bisect_left(self.group_ranks[group], rank)):
+                obsoleted.add(ids[i])
+        return obsoleted
+
+    def newer_than(self, solvable):
+        """
+        Returns a list of the ids of every solvable with the same name as the 
+        given one, of any arch, and a higher epoch-version-release.
+        """
+        newer = []
+        for group in self.groups_by_name.get(solvable.nameid, []):
+            ids = self.group_ids[group]
+            if group == self.group[solvable.id]:
+                start = bisect.bisect_right(self.group_ranks[group], self.rank[solvable.id])
+                newer.extend(ids[start:])
+                continue
+            # Ranks cannot be compared between groups, so compare EVRs, 
+            # starting from the highest
+            for solvid in reversed(ids):
+                if self.pool.solvables[solvid].evrcmp(solvable) <= 0:
+                    break
+                newer.append(solvid)
+        return newer
+
+
+class _LRUCache(object):
+    """
+    Mapping of a bounded size, which discards the least recently used items 
+    when it is full. It counts hits and misses, for debugging.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key, factory):
+        """
+        Returns the item for *key*, calling *factory* to produce it if it is 
+        not cached.
+        """
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            value = factory()
+        else:
+            self.hits += 1
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
 
 class UnreadablePackageError(Exception):
     """
@@ -94,6 +623,348 @@ class DependencySet(object):
         return dict(self._packagedeps)
 
 
+class RepoSet(object):
+    """
+    A set of repos loaded into a libsolv pool, to check packages against.
+
+    Downloading and loading the repos is most of the cost of checking 
+    packages, so a repo set can be loaded once and then used by many 
+    :py:class:`DependencyAnalyzer` instances in turn, each for its own 
+    packages under test. An analyzer adds its packages to the pool, and 
+    closing it removes them again, so only one analyzer can use a repo set at 
+    a time.
+    """
+
+    def __init__(self, repos, arch=None, max_parallel_downloads=4,
+            load_filelists=False):
+        """
+        :param repos: An iterable of :py:class:`rpmdeplint.repodata.Repo` instances
+        :param arch: The arch to solve dependencies for [default: the host arch]
+        :param max_parallel_downloads: Maximum number of repos to download 
+                                       repodata from concurrently
+        :param load_filelists: If True, load the complete file lists for all 
+                               repos up front. Otherwise they are only loaded 
+                               when a check needs them.
+        """
+        self.pool = solv.Pool()
+        self.pool.setarch(arch)
+        #: The arch used for solving dependencies
+        self.arch = arch or os.uname()[4]
+        self.repos_by_name = {}  #: Mapping of {repo name: :py:class:`rpmdeplint.repodata.Repo`}
+        self._solv_repos = {}
+        self.filelists_loaded = False
+        #: Mapped file index of each repo, by name (None if it has none)
+        self._file_indexes = {}
+        self._table = None
+        #: The repo of packages under test added by the current analyzer
+        self._commandline_repo = None
+        # Repodata is downloaded by a pool of threads, while this thread loads 
+        # each repo into the pool as soon as it is ready. The libsolv pool is 
+        # not thread-safe so loading is always done here, in the original 
+        # order of the repos.
+        repos = list(repos)
+        download_pool = ThreadPool(max(1, min(max_parallel_downloads, len(repos))))
+        try:
+            download = functools.partial(_download_repodata, load_filelists=load_filelists)
+            for repo, error in download_pool.imap(download, repos):
+                if error is not None:
+                    if repo.skip_if_unavailable:
+                        logger.warn('Skipping repo %s: %s', repo.name, error)
+                        continue
+                    else:
+                        raise error
+                self._solv_repos[repo.name] = self._load_repo(repo)
+                self.repos_by_name[repo.name] = repo
+        finally:
+            download_pool.terminate()
+            download_pool.join()
+
+        self._addfileprovides()
+        self.pool.createwhatprovides()
+        if load_filelists:
+            self.ensure_filelists()
+
+    def _addfileprovides(self):
+        """
+        Adds file provides for every file dependency in the pool, and 
+        remembers which file dependencies there are, so that packages added 
+        later can be given file provides incrementally.
+        """
+        if hasattr(self.pool, 'addfileprovides_queue'):
+            #: Ids of the file dependencies which have file provides
+            self._file_deps = set(self.pool.addfileprovides_queue())
+        else:
+            self.pool.addfileprovides()
+            self._file_deps = None
+
+    def _load_repo(self, repo):
+        """
+        Adds the packages from the given (downloaded) repo to the pool, using 
+        only primary.xml. Parsing it is slow for large repos, so the parsed 
+        result is cached as a solv file keyed by the repodata checksum, and 
+        loaded from there on subsequent runs.
+        """
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import cache_entry_path
+
+        solv_repo = self.pool.add_repo(repo.name)
+        cache_path = cache_entry_path(_solv_cache_checksum('primary', repo.primary_checksum))
+        if self._add_cached_solv(solv_repo, cache_path):
+            logger.debug('Using cached solv file %s for %s', cache_path, repo.name)
+            return solv_repo
+        # solv.xfopen does not accept unicode filenames on Python 2
+        solv_repo.add_rpmmd(solv.xfopen_fd(str(repo.primary_url), repo.primary.fileno()),
+                None)
+        self._write_cached_solv(solv_repo, cache_path)
+        return solv_repo
+
+    def _load_filelists(self, solv_repo, repo):
+        """
+        Extends the packages from the given repo with the complete file lists 
+        from filelists.xml. The result is cached as a solv extension file, 
+        separately from the primary solv file.
+        """
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import cache_entry_path
+
+        cache_path = cache_entry_path(_solv_cache_checksum('filelists',
+                repo.primary_checksum, repo.filelists_checksum))
+        if self._add_cached_solv(solv_repo, cache_path, solv.Repo.REPO_EXTEND_SOLVABLES):
+            logger.debug('Using cached solv file %s for %s', cache_path, repo.name)
+            return
+        # The file lists go into their own repodata area, so that they can be 
+        # written out as an extension without the rest of the repo.
+        repodata = solv_repo.add_repodata()
+        solv_repo.add_rpmmd(solv.xfopen_fd(str(repo.filelists_url), repo.filelists.fileno()),
+                None, solv.Repo.REPO_EXTEND_SOLVABLES | solv.Repo.REPO_REUSE_REPODATA)
+        repodata.internalize()
+        self._write_cached_solv(repodata, cache_path)
+
+    def ensure_filelists(self):
+        """
+        Loads the complete file lists for all repos, if they are not loaded 
+        already.
+        """
+        if self.filelists_loaded:
+            return
+        for name, repo in self.repos_by_name.items():
+            logger.debug('Loading file lists for %s', name)
+            self._load_filelists(self._solv_repos[name], repo)
+        self.filelists_loaded = True
+        self._addfileprovides()
+        self.pool.createwhatprovides()
+
+    def _add_cached_solv(self, solv_repo, cache_path, flags=0):
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import record_cache_entry
+
+        try:
+            f = open(cache_path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return False # not cached yet
+            raise
+        with f:
+            solv_file = solv.xfopen_fd('', f.fileno())
+            ok = solv_repo.add_solv(solv_file, flags)
+            solv_file.close()
+        if not ok:
+            # Probably written by an incompatible libsolv, or truncated. 
+            # Parse the XML instead.
+            logger.debug('Ignoring unreadable solv file %s: %s',
+                    cache_path, self.pool.errstr)
+            if not flags & solv.Repo.REPO_EXTEND_SOLVABLES:
+                # Throw away whatever was loaded. An extension is 
+                # rejected before any of it is added.
+                solv_repo.empty()
+            return False
+        # Bump the modtime on the cache file we are using, for consistency 
+        # with the repodata files.
+        os.utime(cache_path, None)
+        record_cache_entry(cache_path, 'solv')
+        return True
+
+    def _write_cached_solv(self, data, cache_path):
+        """
+        Writes *data* (a repo, or a single repodata area of a repo) to a solv 
+        file in the cache.
+        """
+        def write(fd):
+            solv_file = solv.xfopen_fd('', fd)
+            ok = data.write(solv_file)
+            return solv_file.close() and ok
+        return self._write_cache_file(cache_path, 'solv', write)
+
+    def _write_cache_file(self, cache_path, kind, content):
+        """
+        Writes a cache file using :py:func:`rpmdeplint.repodata.write_cache_file`.
+        Failing to write the cache is not an error, it just means the data
+        will be computed again next time. Returns True if the file was written.
+        """
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import write_cache_file
+
+        try:
+            written = write_cache_file(cache_path, kind, content)
+        except Exception as e:
+            # Whatever went wrong, the data can still be used without caching it
+            logger.warn('Cannot write %s cache file %s: %s', kind, cache_path, e)
+            return False
+        if not written:
+            logger.warn('Cannot write %s cache file %s', kind, cache_path)
+            return False
+        logger.debug('Wrote %s cache file %s', kind, cache_path)
+        return True
+
+    def _file_index(self, name):
+        """
+        Returns the :py:class:`_MappedFileIndex` of the file lists of the 
+        named repo, or None if it cannot be indexed in the cache. The index is 
+        stored in the cache, keyed by the repodata checksums, and built the 
+        first time it is needed.
+        """
+        if name in self._file_indexes:
+            return self._file_indexes[name]
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import cache_entry_path, record_cache_entry
+
+        repo = self.repos_by_name[name]
+        solv_repo = self._solv_repos[name]
+        cache_path = cache_entry_path(_solv_cache_checksum('fileindex',
+                repo.primary_checksum, repo.filelists_checksum))
+        index = self._open_file_index(solv_repo, cache_path)
+        if index is None:
+            def write(fd):
+                with os.fdopen(os.dup(fd), 'wb') as f:
+                    return _MappedFileIndex.write(f, solv_repo)
+            logger.debug('Building file index for %s', name)
+            if self._write_cache_file(cache_path, 'fileindex', write):
+                index = self._open_file_index(solv_repo, cache_path)
+        else:
+            logger.debug('Using cached file index %s for %s', cache_path, name)
+            os.utime(cache_path, None)
+            record_cache_entry(cache_path, 'fileindex')
+        self._file_indexes[name] = index
+        return index
+
+    def _open_file_index(self, solv_repo, cache_path):
+        try:
+            return _MappedFileIndex(cache_path, solv_repo)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.debug('Ignoring unreadable file index %s: %s', cache_path, e)
+        except ValueError as e:
+            logger.debug('Ignoring unreadable file index %s: %s', cache_path, e)
+        return None
+
+    def _solvable_table(self):
+        """
+        Returns a :py:class:`_SolvableTable` of the packages in the repos, 
+        without any packages under test. It is built once, since loading file 
+        lists does not add solvables.
+        """
+        if self._table is None:
+            self._table = _SolvableTable(self.pool, (s for s in self.pool.solvables
+                    if s.repo.name != '@commandline'))
+        return self._table
+
+    def _add_commandline_repo(self, packages):
+        """
+        Adds a repo named @commandline containing the given RPM package 
+        paths, and returns it with the list of their solvables.
+        """
+        if self._commandline_repo is not None:
+            raise RuntimeError('This RepoSet is already in use by another '
+                    'DependencyAnalyzer, which must be closed first')
+        repo = self.pool.add_repo('@commandline')
+        solvables = []
+        try:
+            for rpmpath in packages:
+                solvable = repo.add_rpm(rpmpath)
+                if solvable is None:
+                    # pool.errstr is already prefixed with the filename
+                    raise UnreadablePackageError('Failed to read package: %s'
+                            % self.pool.errstr)
+                solvables.append(solvable)
+        except:
+            repo.free(True)
+            raise
+        self._commandline_repo = repo
+        self._add_file_provides(repo)
+        self.pool.createwhatprovides()
+        return repo, solvables
+
+    def _add_file_provides(self, solv_repo):
+        """
+        Adds file provides for the given newly added repo, with the same 
+        result as :py:meth:`solv.Pool.addfileprovides` but without scanning 
+        the file lists of all the other repos again. Only the repos which 
+        contain a file newly depended on by the new repo are searched, and 
+        the new repo is given file provides for the file dependencies 
+        already known.
+        """
+        if self._file_deps is None:
+            # Older libsolv cannot tell us the known file dependencies
+            self.pool.addfileprovides()
+            return
+        pool = self.pool
+        provides = pool.str2id('solvable:provides')
+        filelist = pool.str2id('solvable:filelist')
+        new_deps = set()
+        for solvable in solv_repo.solvables_iter():
+            for keyname in _file_dependency_keynames:
+                for dep in solvable.lookup_deparray(pool.str2id(keyname)):
+                    if dep.id in self._file_deps:
+                        continue
+                    name = str(dep)
+                    if name.startswith('/') and ' ' not in name:
+                        new_deps.add(dep.id)
+        flags = (solv.Dataiterator.SEARCH_STRING | solv.Dataiterator.SEARCH_FILES
+                | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
+        for depid in new_deps:
+            for match in pool.Dataiterator(filelist, pool.id2str(depid), flags):
+                if match.solvable.repo.id != solv_repo.id:
+                    match.solvable.add_deparray(provides, depid, 1)
+            self._file_deps.add(depid)
+        iterator = solv_repo.Dataiterator(filelist, None,
+                solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
+        for match in iterator:
+            depid = pool.str2id(match.str, False)
+            if depid in self._file_deps:
+                match.solvable.add_deparray(provides, depid, 1)
+
+    def _remove_commandline_repo(self):
+        """
+        Removes the repo added by :py:meth:`_add_commandline_repo`, restoring 
+        the pool to the repos alone. File provides added to the repos for 
+        the packages under test are kept, since they are still true.
+        """
+        if self._commandline_repo is None:
+            return
+        self._commandline_repo.free(True)
+        self._commandline_repo = None
+        self.pool.createwhatprovides()
+
+    def close(self):
+        """
+        Closes the repodata files held open for each repo, and removes any 
+        temporary directories created while downloading them. The repo set 
+        cannot load any more data from the repos after this.
+        """
+        for repo in self.repos_by_name.values():
+            repo.close()
+        for index in self._file_indexes.values():
+            if index is not None:
+                index.close()
+        self._file_indexes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+
 class DependencyAnalyzer(object):
     """An object which checks packages against provided repos
     for dependency satisfiability.
@@ -101,50 +972,69 @@ class DependencyAnalyzer(object):
     Construct an instance for a particular set of packages you want to test,
     with the repos you want to test against. Then call the individual checking
     methods to perform each check.
+
+    To check several sets of packages against the same repos, load them once 
+    as a :py:class:`RepoSet` and pass that as *repos* for each analyzer.
     """
 
-    def __init__(self, repos, packages, arch=None):
+    def __init__(self, repos, packages, arch=None, max_parallel_downloads=4,
+            load_filelists=False):
         """
-        :param repos: An iterable of :py:class:`rpmdeplint.repodata.Repo` instances
+        :param repos: An iterable of :py:class:`rpmdeplint.repodata.Repo` 
+                      instances, or a :py:class:`RepoSet` already loaded. In 
+                      that case the other parameters besides *packages* are 
+                      ignored, and closing the analyzer removes its packages 
+                      from the repo set again rather than closing it.
         :param packages: An iterable of RPM package paths to be tested
+        :param max_parallel_downloads: Maximum number of repos to download 
+                                       repodata from concurrently
+        :param load_filelists: If True, load the complete file lists for all 
+                               repos up front. Otherwise they are only loaded 
+                               when a check needs them.
         """
-        # delayed import to avoid circular dependency
-        from rpmdeplint.repodata import RepoDownloadError
+        if isinstance(repos, RepoSet):
+            self.repo_set = repos
+            self._owns_repo_set = False
+        else:
+            self.repo_set = RepoSet(repos, arch=arch,
+                    max_parallel_downloads=max_parallel_downloads,
+                    load_filelists=load_filelists)
+            self._owns_repo_set = True
+        self.pool = self.repo_set.pool
+        #: The arch used for solving dependencies
+        self.arch = self.repo_set.arch
+        self.repos_by_name = self.repo_set.repos_by_name  #: Mapping of {repo name: :py:class:`rpmdeplint.repodata.Repo`}
+        self._solv_repos = self.repo_set._solv_repos
 
-        self.pool = solv.Pool()
-        self.pool.setarch(arch)
+        #: Parsed package headers, by solvable id
+        self.header_cache = _LRUCache(maxsize=64)
+        #: :py:class:`rpm.files` objects (or :py:class:`rpm.fi` objects with 
+        #: an index of their filenames, for rpm < 4.12), by solvable id
+        self.files_cache = _LRUCache(maxsize=64)
+        #: File attributes from headers or from the persistent store
+        self.file_attributes_cache = _LRUCache(maxsize=256)
+        #: rpm transaction sets for reading headers, by whether the file 
+        #: contains just the header
+        self._header_ts = {}
+        self._file_indexes = None
+        #: Results of solving the installation of a single solvable, by 
+        #: (solvable id, context)
+        self._install_results = {}
+        #: Number of solves avoided by reusing those results
+        self.solves_saved = 0
+        self._baseline = None
+        self._baseline_changed = False
+        self._table = None
 
         #: List of :py:class:`solv.Solvable` to be tested (corresponding to *packages* parameter)
         self.solvables = []
-        self.commandline_repo = self.pool.add_repo('@commandline')
-        for rpmpath in packages:
-            solvable = self.commandline_repo.add_rpm(rpmpath)
-            if solvable is None:
-                # pool.errstr is already prefixed with the filename
-                raise UnreadablePackageError('Failed to read package: %s'
-                        % self.pool.errstr)
-            self.solvables.append(solvable)
-
-        self.repos_by_name = {}  #: Mapping of {repo name: :py:class:`rpmdeplint.repodata.Repo`}
-        for repo in repos:
-            try:
-                repo.download_repodata()
-            except RepoDownloadError as e:
-                if repo.skip_if_unavailable:
-                    logger.warn('Skipping repo %s: %s', repo.name, e)
-                    continue
-                else:
-                    raise
-            solv_repo = self.pool.add_repo(repo.name)
-            # solv.xfopen does not accept unicode filenames on Python 2
-            solv_repo.add_rpmmd(solv.xfopen_fd(str(repo.primary_url), repo.primary.fileno()),
-                    None)
-            solv_repo.add_rpmmd(solv.xfopen_fd(str(repo.filelists_url), repo.filelists.fileno()),
-                    None, solv.Repo.REPO_EXTEND_SOLVABLES)
-            self.repos_by_name[repo.name] = repo
-
-        self.pool.addfileprovides()
-        self.pool.createwhatprovides()
+        self.commandline_repo = None
+        try:
+            self._add_packages(packages)
+        except:
+            if self._owns_repo_set:
+                self.repo_set.close()
+            raise
 
         # Special handling for "installonly" packages: we create jobs to mark 
         # installonly package names as "multiversion" and then set those as 
@@ -156,14 +1046,100 @@ class DependencyAnalyzer(object):
             multiversion_jobs.extend(selection.jobs(solv.Job.SOLVER_MULTIVERSION))
         self.pool.setpooljobs(multiversion_jobs)
 
-    # Context manager protocol is only implemented for backwards compatibility.
-    # There are actually no resources to acquire or release.
+    def _add_packages(self, packages):
+        self.commandline_repo, self.solvables = \
+                self.repo_set._add_commandline_repo(packages)
+        if self._has_unresolved_file_requires():
+            self._ensure_filelists()
+
+    def reset_packages(self, packages):
+        """
+        Replaces the packages under test with the given ones, keeping the 
+        repos loaded. This is much cheaper than constructing a new analyzer 
+        for the same repos.
+
+        :param packages: An iterable of RPM package paths to be tested
+        """
+        # Anything remembered by solvable id may refer to the old packages
+        self.header_cache.clear()
+        self.files_cache.clear()
+        self.file_attributes_cache.clear()
+        self._install_results.clear()
+        self._table = None
+        self._file_indexes = None
+        self._save_repoclosure_baseline()
+        self._baseline = None
+        self._baseline_changed = False
+        self.repo_set._remove_commandline_repo()
+        self.commandline_repo = None
+        self.solvables = []
+        self._add_packages(packages)
+
+    def _has_unresolved_file_requires(self):
+        """
+        Returns True if any package under test requires a file which is not 
+        provided by anything in the pool so far. Primary.xml only lists the 
+        commonly required files, so the file may still be found in the 
+        complete file lists.
+        """
+        requires = self.pool.str2id('solvable:requires')
+        for solvable in self.solvables:
+            for dep in solvable.lookup_deparray(requires):
+                if str(dep).startswith('/') and not self.pool.whatprovides(dep.id):
+                    logger.debug('File requirement %s of %s is not in primary.xml',
+                            dep, solvable)
+                    return True
+        return False
+
+    def _ensure_filelists(self):
+        """
+        Loads the complete file lists for all repos, if they are not loaded 
+        already.
+        """
+        if self.repo_set.filelists_loaded:
+            return
+        self.repo_set.ensure_filelists()
+        self._file_indexes = None
+        # Newly provided files could satisfy requirements which failed before
+        self._install_results.clear()
+        self._baseline = None
+
+    def _file_indexes_for(self, paths):
+        """
+        Returns a list of indexes which together cover the file lists of the 
+        whole pool. Each repo has an index in the cache, keyed by its 
+        repodata checksums, which is built the first time it is needed. The 
+        packages under test (and any repo which cannot be indexed in the 
+        cache) are indexed in memory, for the given paths only.
+        """
+        indexes = [_build_file_index(self.commandline_repo, paths)]
+        for name in self.repos_by_name:
+            index = self.repo_set._file_index(name)
+            if index is None:
+                index = _build_file_index(self._solv_repos[name], paths)
+            indexes.append(index)
+        return indexes
+
+    def close(self):
+        """
+        Removes the packages under test from the repo set, so that it can be 
+        used by another analyzer. If the analyzer loaded the repos itself, 
+        also closes the repodata files held open for each repo, and removes 
+        any temporary directories created while downloading them. The 
+        analyzer cannot load any more data from the repos after this.
+        """
+        self._file_indexes = None
+        if self.commandline_repo is not None:
+            self.repo_set._remove_commandline_repo()
+            self.commandline_repo = None
+        if self._owns_repo_set:
+            self.repo_set.close()
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, tb):
-        return
+        self.close()
 
     def download_package(self, solvable):
         if solvable in self.solvables:
@@ -177,6 +1153,26 @@ class DependencyAnalyzer(object):
                 checksum_type=checksum.typestr(),
                 checksum=checksum.hex())
 
+    def download_package_header(self, solvable):
+        """
+        Returns a local path to a file from which the header of the given 
+        package can be read. For packages in remote repos, this avoids 
+        downloading the whole package where possible.
+        """
+        if solvable in self.solvables:
+            # It's a package under test, nothing to download
+            return solvable.lookup_location()[0]
+        href = solvable.lookup_location()[0]
+        baseurl = solvable.lookup_str(self.pool.str2id('solvable:mediabase'))
+        repo = self.repos_by_name[solvable.repo.name]
+        checksum = solvable.lookup_checksum(self.pool.str2id('solvable:checksum'))
+        # This is the end of the header-range from primary.xml, if present
+        header_end = solvable.lookup_num(self.pool.str2id('solvable:headerend'))
+        return repo.download_package_header(href, baseurl,
+                checksum_type=checksum.typestr(),
+                checksum=checksum.hex(),
+                header_end=header_end or None)
+
     def try_to_install_all(self):
         """
         Try to solve the goal of installing each of the packages under test,
@@ -188,38 +1184,76 @@ class DependencyAnalyzer(object):
         ds = DependencySet()
         for solvable in self.solvables:
             logger.debug('Solving install jobs for %s', solvable)
-            jobs = solvable.Selection().jobs(solv.Job.SOLVER_INSTALL)
-            problems = solver.solve(jobs)
+            problems, newsolvables = self._solve_install(solver, solvable)
             if problems:
-                ds.add_package(solvable, [], [six.text_type(p) for p in problems])
+                ds.add_package(solvable, [], problems)
             else:
-                ds.add_package(solvable, solver.transaction().newsolvables(), [])
+                ds.add_package(solvable, newsolvables, [])
 
         ok = len(ds.overall_problems) == 0
+        logger.debug('Solves saved by reusing install results: %d', self.solves_saved)
         return ok, ds
 
-    def _select_obsoleted_by(self, solvables):
+    def _solve_install(self, solver, solvable, context=None, extra_jobs=()):
         """
-        Returns a solv.Selection matching every solvable which is "obsoleted" 
-        by some solvable in the given list -- either due to an explicit 
-        Obsoletes relationship, or because we have a solvable with the same 
-        name with a higher epoch-version-release.
+        Solves the job of installing the given solvable on its own, plus any 
+        extra jobs. The extra jobs must always be the same for the same 
+        context. The result is remembered for the lifetime of the analyzer, so 
+        that every check which needs it only solves it once.
+
+        :return: Tuple of (list of str problems, list of solvables installed)
         """
-        # Start with an empty selection.
-        sel = self.pool.Selection()
-        for solvable in solvables:
-            # Select every solvable with the same name and lower EVR.
-            # XXX are there some special cases with arch-noarch upgrades which this does not handle?
-            sel.add(self.pool.select('{}.{} < {}'.format(solvable.name, solvable.arch, solvable.evr),
-                    solv.Selection.SELECTION_NAME |
-                    solv.Selection.SELECTION_DOTARCH |
-                    solv.Selection.SELECTION_REL))
-            for obsoletes_rel in solvable.lookup_deparray(self.pool.str2id('solvable:obsoletes')):
-                # Select every solvable matching the obsoletes relationship by name.
-                sel.add(obsoletes_rel.Selection_name())
-        return sel
-
-    def find_repoclosure_problems(self):
+        key = (solvable.id, context)
+        result = self._install_results.get(key)
+        if result is not None:
+            self.solves_saved += 1
+            return result
+        jobs = solvable.Selection().jobs(solv.Job.SOLVER_INSTALL) + list(extra_jobs)
+        problems = solver.solve(jobs)
+        if problems:
+            result = ([six.text_type(p) for p in problems], [])
+        else:
+            result = ([], solver.transaction().newsolvables())
+        self._install_results[key] = result
+        return result
+
+    def _solvable_table(self):
+        """
+        Returns a :py:class:`_SolvableTable` of every solvable in the pool, 
+        extending the table of the repos with the packages under test.
+        """
+        if self._table is None:
+            self._table = self.repo_set._solvable_table().extended(self.solvables)
+        return self._table
+
+    def _requiring_closure(self, solvables):
+        """
+        Returns the set of ids of the given solvables, and of every solvable 
+        which requires any of them, directly or indirectly.
+        """
+        requires = self.pool.str2id('solvable:requires')
+        provides = self.pool.str2id('solvable:provides')
+        closure = set(s.id for s in solvables)
+        queue = list(solvables)
+        while queue:
+            solvable = queue.pop()
+            if hasattr(self.pool, 'whatmatchessolvable'):
+                # Marker 0 means both requires and prerequires
+                requiring = self.pool.whatmatchessolvable(requires, solvable, 0)
+            else:
+                # Older libsolv: match each of the solvable's provides, both 
+                # its own and those added by addfileprovides()
+                requiring = []
+                for marker in [-1, 1]:
+                    for dep in solvable.lookup_deparray(provides, marker):
+                        requiring.extend(self.pool.whatmatchesdep(requires, dep.id, 0))
+            for other in requiring:
+                if other.id not in closure:
+                    closure.add(other.id)
+                    queue.append(other)
+        return closure
+
+    def find_repoclosure_problems(self, full=False, jobs=1, engine='bulk'):
         """
         Checks for any package in the repos which would have unsatisfied 
         dependencies, if the packages under test were added to the repos.
@@ -229,19 +1263,59 @@ class DependencyAnalyzer(object):
         which is technically a valid solution but is not expected if the 
         packages are supposed to be updates.
 
+        A problem is only reported if it is caused by the packages under test 
+        upgrading or obsoleting some packages in the repos, so by default only 
+        the packages which (directly or indirectly) require those are checked. 
+        Pre-existing problems in other packages are not reported, nor warned 
+        about.
+
+        :param full: If True, check every package in the repos instead
+        :param jobs: Number of processes to check packages in. The processes 
+                     are forked from this one, so they share the pool with it.
+        :param engine: If "bulk", first find the packages which can be 
+                       installed by installing as many as possible at once, 
+                       and only solve for the rest one at a time. If 
+                       "single", solve for every package one at a time. The 
+                       problems found are the same either way.
         :return: List of str problem descriptions if any problems were found
         """
+        if engine not in ('bulk', 'single'):
+            raise ValueError('Unknown repoclosure engine %r' % engine)
+        # Packages in the repos may require files which are only listed in 
+        # filelists.xml. Without them, breakage caused by the packages under 
+        # test would be mistaken for a pre-existing problem.
+        self._ensure_filelists()
         problems = []
         solver = self.pool.Solver()
-        # This selection matches packages obsoleted by our packages under test.
-        obs_sel = self._select_obsoleted_by(self.solvables)
-        # This selection matches packages obsoleted by other existing packages in the repo.
-        existing_obs_sel = self._select_obsoleted_by(s for s in self.pool.solvables
+        table = self._solvable_table()
+        # This set contains packages obsoleted by our packages under test.
+        obs_set = table.obsoleted_by(self.solvables)
+        # This set contains packages obsoleted by other existing packages in the repo.
+        existing_obs_set = table.obsoleted_by(s for s in self.pool.solvables
                 if s.repo.name != '@commandline')
-        obsoleted = obs_sel.solvables() + existing_obs_sel.solvables()
-        logger.debug('Excluding the following obsoleted packages:\n%s',
-                '\n'.join('  {}'.format(s) for s in obsoleted))
+        obsoleted = _SolvableIdSet(self.pool, table.size)
+        obsoleted.update(obs_set)
+        obsoleted.update(existing_obs_set)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Excluding the following obsoleted packages:\n%s',
+                    '\n'.join('  {}'.format(s) for s in obsoleted.solvables()))
+        # Each set is passed to the solver as a single job
+        erase_jobs = obsoleted.jobs(solv.Job.SOLVER_ERASE)
+        existing_erase_jobs = existing_obs_set.jobs(solv.Job.SOLVER_ERASE)
+        if full:
+            affected = None
+        else:
+            # A package only has a new problem if it cannot be installed once 
+            # the packages replaced by the packages under test are erased, but 
+            # it can be installed from the repos alone. So it must need one of 
+            # those replaced packages.
+            affected = self._requiring_closure(obs_set.solvables())
+            logger.debug('Checking %d packages affected by the packages under test',
+                    len(affected))
+        candidates = []
         for solvable in self.pool.solvables:
+            if affected is not None and solvable.id not in affected:
+                continue # cannot have a new problem
             if solvable in self.solvables:
                 continue # checked by check-sat command instead
             if solvable in obsoleted:
@@ -251,29 +1325,210 @@ class DependencyAnalyzer(object):
                     'Skipping requirements for package {} arch does not match '
                     'Architecture under test'.format(six.text_type(solvable)))
                 continue
-            logger.debug('Checking requires for %s', solvable)
-            # XXX limit available packages to compatible arches?
-            # (use libsolv archpolicies somehow)
-            jobs = (solvable.Selection().jobs(solv.Job.SOLVER_INSTALL) +
-                    obs_sel.jobs(solv.Job.SOLVER_ERASE) +
-                    existing_obs_sel.jobs(solv.Job.SOLVER_ERASE))
-            solver_problems = solver.solve(jobs)
-            if solver_problems:
-                problem_msgs = [six.text_type(p) for p in solver_problems]
-                # If it's a pre-existing problem with repos (that is, the 
-                # problem also exists when the packages under test are 
-                # excluded) then warn about it here but don't consider it 
-                # a problem.
-                jobs = (solvable.Selection().jobs(solv.Job.SOLVER_INSTALL) +
-                        existing_obs_sel.jobs(solv.Job.SOLVER_ERASE))
-                existing_problems = solver.solve(jobs)
-                if existing_problems:
-                    for p in existing_problems:
-                        logger.warn('Ignoring pre-existing repoclosure problem: %s', p)
-                else:
-                    problems.extend(problem_msgs)
+            candidates.append(solvable)
+        baseline = self._repoclosure_baseline()
+        if engine == 'bulk':
+            remaining = self._not_installable_in_bulk(solver, candidates, erase_jobs)
+        else:
+            remaining = candidates
+        requiring_packages_under_test = self._requiring_closure(self.solvables)
+        check = functools.partial(self._check_repoclosure, solver,
+                erase_jobs=erase_jobs, existing_erase_jobs=existing_erase_jobs,
+                requiring_packages_under_test=requiring_packages_under_test)
+        if jobs > 1 and len(remaining) > 1:
+            results = self._map_in_forked_workers(check, remaining, jobs)
+        else:
+            results = map(check, remaining)
+        results = dict((solvable.id, result) for solvable, result in zip(remaining, results))
+        # Results are merged in the same order as the packages were checked 
+        # in, so the output does not depend on the number of jobs.
+        for solvable in candidates:
+            problem_msgs, existing_problems = results.get(solvable.id, ([], []))
+            if existing_problems:
+                for p in existing_problems:
+                    logger.warn('Ignoring pre-existing repoclosure problem: %s', p)
+            else:
+                problems.extend(problem_msgs)
+            if problem_msgs and solvable.id not in requiring_packages_under_test:
+                # Keep the baseline entries found by worker processes
+                key = self._baseline_key(solvable)
+                if key not in baseline:
+                    baseline[key] = existing_problems
+                    self._baseline_changed = True
+        self._save_repoclosure_baseline()
+        logger.debug('Solves saved by reusing install results: %d', self.solves_saved)
+        return problems
+
+    def _not_installable_in_bulk(self, solver, solvables, extra_jobs):
+        """
+        Tries to install all the given solvables at once, along with the extra 
+        jobs, with weak install jobs so that the solver drops the jobs for any 
+        packages which cannot be installed. Each package in the resulting 
+        transaction can certainly be installed on its own, so it does not need 
+        a solve of its own. The rest are tried again in further rounds, until 
+        a round installs nothing more. This is the same approach as libsolv's 
+        installcheck tool.
+
+        :return: List of the given solvables which were not installed, in order
+        """
+        how = solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_INSTALL | solv.Job.SOLVER_WEAK
+        remaining = list(solvables)
+        rounds = 0
+        while remaining:
+            rounds += 1
+            jobs = [self.pool.Job(how, solvable.id) for solvable in remaining]
+            if solver.solve(jobs + extra_jobs):
+                break # problems with the extra jobs, not the weak ones
+            installed = set(solvable.id for solvable in solver.transaction().newsolvables())
+            not_installed = [solvable for solvable in remaining
+                    if solvable.id not in installed]
+            if len(not_installed) == len(remaining):
+                break
+            for solvable in remaining:
+                if solvable.id in installed:
+                    self._install_results[(solvable.id, 'repoclosure')] = ([], [])
+            remaining = not_installed
+        logger.debug('Found %d of %d packages installable in %d bulk solves',
+                len(solvables) - len(remaining), len(solvables), rounds)
+        return remaining
+
+    def _check_repoclosure(self, solver, solvable, erase_jobs, existing_erase_jobs,
+            requiring_packages_under_test):
+        """
+        Checks the requirements of the given repo package for 
+        :py:meth:`find_repoclosure_problems`, with jobs erasing the obsoleted 
+        packages, and only those obsoleted by other repo packages.
+
+        :return: Tuple of (list of str problems, list of str pre-existing 
+                 problems which were found instead)
+        """
+        logger.debug('Checking requires for %s', solvable)
+        # XXX limit available packages to compatible arches?
+        # (use libsolv archpolicies somehow)
+        problem_msgs, _ = self._solve_install(solver, solvable, 'repoclosure',
+                erase_jobs)
+        if not problem_msgs:
+            return [], []
+        # If it's a pre-existing problem with repos (that is, the 
+        # problem also exists when the packages under test are 
+        # excluded) then warn about it but don't consider it 
+        # a problem.
+        return problem_msgs, self._preexisting_problems(solver, solvable,
+                existing_erase_jobs, requiring_packages_under_test)
+
+    def _map_in_forked_workers(self, func, solvables, jobs):
+        """
+        Returns the results of calling *func* on each of the given solvables, 
+        in order, computed by *jobs* worker processes. The workers are forked, 
+        so they inherit the pool (and everything else) copy-on-write instead 
+        of loading it again. Solvables are handed out in small chunks as each 
+        worker becomes free, so that a few slow solves do not hold up the 
+        others.
+        """
+        global _worker_state
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing # Python 2 always forks
+        chunksize = max(1, min(64, len(solvables) // (jobs * 8)))
+        logger.debug('Checking %d packages in %d processes', len(solvables), jobs)
+        _worker_state = (func, [s.id for s in solvables], self.pool)
+        workers = context.Pool(min(jobs, len(solvables)))
+        try:
+            results = list(workers.imap(_call_in_worker, range(len(solvables)), chunksize))
+            workers.close()
+        except:
+            workers.terminate()
+            raise
+        finally:
+            workers.join()
+            _worker_state = None
+        return results
+
+    def _repoclosure_baseline_path(self):
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import cache_entry_path
+
+        checksums = []
+        for name in sorted(self.repos_by_name):
+            repo = self.repos_by_name[name]
+            checksums.append(repo.primary_checksum)
+            if self.repo_set.filelists_loaded:
+                checksums.append(repo.filelists_checksum)
+        return cache_entry_path(_solv_cache_checksum('baseline', self.arch, *checksums))
+
+    def _repoclosure_baseline(self):
+        """
+        Returns the baseline of pre-existing repoclosure problems: a dict of 
+        {repo package: list of str problems installing it from the repos 
+        alone}. It depends only on the repos, so it is stored in the cache 
+        keyed by their repodata checksums, and shared by every run against 
+        the same repos whatever the packages under test. It never has more 
+        entries than there are packages in the repos.
+        """
+        if self._baseline is None:
+            path = self._repoclosure_baseline_path()
+            try:
+                with open(path, 'rb') as f:
+                    self._baseline = json.loads(f.read().decode('utf8'))
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    logger.debug('Ignoring unreadable repoclosure baseline %s: %s', path, e)
+                self._baseline = {}
+            except ValueError as e:
+                logger.debug('Ignoring unreadable repoclosure baseline %s: %s', path, e)
+                self._baseline = {}
+            else:
+                # delayed import to avoid circular dependency
+                from rpmdeplint.repodata import record_cache_entry
+                logger.debug('Using cached repoclosure baseline %s', path)
+                os.utime(path, None)
+                record_cache_entry(path, 'baseline')
+            self._baseline_changed = False
+        return self._baseline
+
+    def _baseline_key(self, solvable):
+        return u'{}:{}'.format(solvable.repo.name, six.text_type(solvable))
+
+    def _preexisting_problems(self, solver, solvable, existing_erase_jobs,
+            requiring_packages_under_test):
+        """
+        Returns the list of str problems installing the given repo package 
+        without erasing the packages replaced by the packages under test.
+
+        Unless the package requires (directly or indirectly) something 
+        provided by the packages under test, they cannot make a difference, 
+        so the problems are those installing it from the repos alone, which 
+        are taken from the baseline if possible.
+
+        :param requiring_packages_under_test: Set of ids of the repo packages 
+                                              which do, from 
+                                              :py:meth:`_requiring_closure`
+        """
+        if solvable.id in requiring_packages_under_test:
+            problems, _ = self._solve_install(solver, solvable, 'repoclosure-existing',
+                    existing_erase_jobs)
+            return problems
+        baseline = self._repoclosure_baseline()
+        key = self._baseline_key(solvable)
+        if key in baseline:
+            self.solves_saved += 1
+            return baseline[key]
+        jobs = list(existing_erase_jobs)
+        jobs.append(self.pool.Job(solv.Job.SOLVER_SOLVABLE_REPO | solv.Job.SOLVER_LOCK,
+                self.commandline_repo.id))
+        problems, _ = self._solve_install(solver, solvable, 'repoclosure-repos', jobs)
+        baseline[key] = problems
+        self._baseline_changed = True
         return problems
 
+    def _save_repoclosure_baseline(self):
+        if not self._baseline_changed:
+            return
+        data = json.dumps(self._baseline, sort_keys=True).encode('ascii')
+        self.repo_set._write_cache_file(self._repoclosure_baseline_path(), 'baseline', data)
+        self._baseline_changed = False
+
     def _files_in_solvable(self, solvable):
         iterator = solvable.Dataiterator(self.pool.str2id('solvable:filelist'), None,
                 solv.Dataiterator.SEARCH_FILES | solv.Dataiterator.SEARCH_COMPLETE_FILELIST)
@@ -284,45 +1539,191 @@ class DependencyAnalyzer(object):
         Returns True if the given packages can be installed together.
         """
         solver = self.pool.Solver()
-        left_install_jobs = left.Selection().jobs(solv.Job.SOLVER_INSTALL)
-        right_install_jobs = right.Selection().jobs(solv.Job.SOLVER_INSTALL)
         # First check if each one can be installed on its own. If either of 
         # these fails it is a warning, because it means we have no way to know 
         # if they can be installed together or not.
-        problems = solver.solve(left_install_jobs)
+        problems, _ = self._solve_install(solver, left)
         if problems:
             logger.warn('Ignoring conflict candidate %s '
                     'with pre-existing dependency problems: %s',
                     left, problems[0])
             return False
-        problems = solver.solve(right_install_jobs)
+        problems, _ = self._solve_install(solver, right)
         if problems:
             logger.warn('Ignoring conflict candidate %s '
                     'with pre-existing dependency problems: %s',
                     right, problems[0])
             return False
-        problems = solver.solve(left_install_jobs + right_install_jobs)
+        problems = solver.solve(left.Selection().jobs(solv.Job.SOLVER_INSTALL) +
+                right.Selection().jobs(solv.Job.SOLVER_INSTALL))
         if problems:
             logger.debug('Conflict candidates %s and %s cannot be installed together: %s',
                     left, right, problems[0])
             return False
         return True
 
+    def _read_header(self, solvable):
+        """
+        Returns the parsed header of the given package, downloading it first 
+        if necessary.
+        """
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import Repo
+
+        def read():
+            path = self.download_package_header(solvable)
+            try:
+                return self._header_from_file(path)
+            except rpm.error as e:
+                if not path.endswith(Repo.header_suffix):
+                    raise
+                # The header digests do not match, so the range response (or 
+                # the cache entry) was truncated or corrupted
+                logger.debug('Downloading header %s again: %s', path, e)
+                os.unlink(path)
+                return self._header_from_file(self.download_package_header(solvable))
+        return self.header_cache.get(solvable.id, read)
+
+    def _header_from_file(self, path):
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import Repo
+
+        header_only = path.endswith(Repo.header_suffix)
+        if header_only not in self._header_ts:
+            ts = rpm.TransactionSet()
+            flags = rpm._RPMVSF_NOSIGNATURES
+            if header_only:
+                # There is no payload for rpm to verify, but the header 
+                # digests are still checked
+                flags |= rpm._RPMVSF_NOPAYLOAD
+            ts.setVSFlags(flags)
+            self._header_ts[header_only] = ts
+        with open(path, 'rb') as f:
+            return self._header_ts[header_only].hdrFromFdno(f)
+
+    def _local_file_types(self, solvable):
+        """
+        Returns a tuple of (directories, ghosts): the sets of paths in the given 
+        package under test which are directories, and which are ghost files. 
+        The header of a package under test is always available locally.
+        """
+        hdr = self._read_header(solvable)
+        dirs = set()
+        ghosts = set()
+        for filename, mode, flags in zip(_header_strings(hdr, rpm.RPMTAG_FILENAMES),
+                hdr[rpm.RPMTAG_FILEMODES], hdr[rpm.RPMTAG_FILEFLAGS]):
+            if flags & rpm.RPMFILE_GHOST:
+                ghosts.add(filename)
+            elif stat.S_ISDIR(mode & 0xffff):
+                dirs.add(filename)
+        return dirs, ghosts
+
+    def _rpm_files(self, solvable):
+        return self.files_cache.get(solvable.id,
+                lambda: rpm.files(self._read_header(solvable)))
+
+    def _header_file_attributes(self, solvable):
+        return self.file_attributes_cache.get(('header', solvable.id),
+                lambda: _file_attributes_from_header(self._read_header(solvable)))
+
+    def _file_attributes_store_path(self, solvable):
+        """
+        Returns the path in the cache where the file attributes of the given 
+        package from a remote repo are stored, keyed by its checksum. Returns 
+        None for packages under test, which are not stored.
+        """
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import cache_entry_path
+
+        if solvable in self.solvables or self.repos_by_name[solvable.repo.name].librepo_handle.local:
+            return None
+        checksum = solvable.lookup_checksum(self.pool.str2id('solvable:checksum'))
+        if checksum is None:
+            return None
+        return cache_entry_path(checksum.hex()) + '.files'
+
+    def _stored_file_attributes(self, solvable):
+        """
+        Returns the file attributes of the given package, as stored by 
+        :py:meth:`_store_file_attributes`, or None if they are not stored.
+        """
+        return self.file_attributes_cache.get(('stored', solvable.id),
+                lambda: self._load_stored_file_attributes(solvable))
+
+    def _load_stored_file_attributes(self, solvable):
+        # delayed import to avoid circular dependency
+        from rpmdeplint.repodata import record_cache_entry
+
+        path = self._file_attributes_store_path(solvable)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r') as f:
+                stored = json.load(f)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        except ValueError:
+            logger.debug('Ignoring unreadable file attributes %s', path)
+            return None
+        os.utime(path, None)
+        record_cache_entry(path, 'files')
+        return dict((filename, _FileAttributes(*values))
+                for filename, values in stored['files'].items())
+
+    def _store_file_attributes(self, solvable, hdr):
+        """
+        Stores the attributes of all files in the given package header, so 
+        that future conflict checks involving this package do not need to 
+        download or parse its header again.
+        """
+        path = self._file_attributes_store_path(solvable)
+        if path is None:
+            return
+        attributes = _file_attributes_from_header(hdr)
+        content = json.dumps({'files': attributes}, separators=(',', ':'))
+        if not self.repo_set._write_cache_file(path, 'files', content.encode('utf8')):
+            return
+        # Keys are text, like when they are loaded from the store
+        self.file_attributes_cache.put(('stored', solvable.id),
+                dict((_text(filename), value) for filename, value in attributes.items()))
+
+    def _stored_file_conflict_is_permitted(self, left, right, filename):
+        """
+        Like :py:meth:`_file_conflict_is_permitted`, but using the stored file 
+        attributes of *right*. Returns None if they are not stored.
+        """
+        right_files = self._stored_file_attributes(right)
+        if right_files is None:
+            return None
+        left_attributes = self._header_file_attributes(left)[filename]
+        # The stored filenames are always text, even on Python 2
+        right_attributes = right_files[_text(filename)]
+        if _file_attributes_match(left_attributes, right_attributes):
+            logger.debug('Conflict on %s between %s and %s permitted because files match',
+                    filename, left, right)
+            return True
+        if left_attributes.color != right_attributes.color:
+            logger.debug('Conflict on %s between %s and %s permitted because colors differ',
+                    filename, left, right)
+            return True
+        return False
+
     def _file_conflict_is_permitted(self, left, right, filename):
         """
         Returns True if rpm would allow both the given packages to share 
         ownership of the given filename.
         """
+        permitted = self._stored_file_conflict_is_permitted(left, right, filename)
+        if permitted is not None:
+            return permitted
         if not hasattr(rpm, 'files'):
             return self._file_conflict_is_permitted_rpm411(left, right, filename)
 
-        ts = rpm.TransactionSet()
-        ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
-
-        left_hdr = ts.hdrFromFdno(open(left.lookup_location()[0], 'rb'))
-        right_hdr = ts.hdrFromFdno(open(self.download_package(right), 'rb'))
-        left_files = rpm.files(left_hdr)
-        right_files = rpm.files(right_hdr)
+        self._store_file_attributes(right, self._read_header(right))
+        left_files = self._rpm_files(left)
+        right_files = self._rpm_files(right)
         if left_files[filename].matches(right_files[filename]):
             logger.debug('Conflict on %s between %s and %s permitted because files match',
                     filename, left, right)
@@ -333,37 +1734,43 @@ class DependencyAnalyzer(object):
             return True
         return False
 
+    def _rpm_fi(self, solvable):
+        """
+        Returns a tuple of (:py:class:`rpm.fi`, dict of {filename: file index}) 
+        for the given package, for rpm < 4.12 which has no :py:class:`rpm.files`.
+        """
+        def read():
+            fi = rpm.fi(self._read_header(solvable))
+            indexes = {}
+            try:
+                while True:
+                    indexes[fi.FN()] = fi.FX()
+                    fi.next()
+            except StopIteration:
+                pass
+            return fi, indexes
+        return self.files_cache.get(solvable.id, read)
+
     def _file_conflict_is_permitted_rpm411(self, left, right, filename):
         # In rpm 4.12+ the rpmfilesCompare() function is exposed nicely as the 
         # rpm.files.matches Python method. In earlier rpm versions there is 
         # nothing equivalent in the Python bindings, although we can use ctypes 
         # to poke around and call the older rpmfiCompare() C API directly...
-        librpm = ctypes.CDLL('librpm.so.3')
-        _rpm = ctypes.CDLL(os.path.join(os.path.dirname(rpm.__file__), '_rpm.so'))
-        class rpmfi_s(ctypes.Structure): pass
-        librpm.rpmfiCompare.argtypes = [ctypes.POINTER(rpmfi_s), ctypes.POINTER(rpmfi_s)]
-        librpm.rpmfiCompare.restype = ctypes.c_int
-        _rpm.fiFromFi.argtypes = [ctypes.py_object]
-        _rpm.fiFromFi.restype = ctypes.POINTER(rpmfi_s)
-
-        ts = rpm.TransactionSet()
-        ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
-
-        left_hdr = ts.hdrFromFdno(open(left.lookup_location()[0], 'rb'))
-        right_hdr = ts.hdrFromFdno(open(self.download_package(right), 'rb'))
-        left_fi = rpm.fi(left_hdr)
-        try:
-            while left_fi.FN() != filename:
-                left_fi.next()
-        except StopIteration:
+        librpm, _rpm = _rpm411_bindings()
+        self._store_file_attributes(right, self._read_header(right))
+        left_fi, left_indexes = self._rpm_fi(left)
+        right_fi, right_indexes = self._rpm_fi(right)
+        if filename not in left_indexes:
             raise KeyError('Entry %s not found in %s' % (filename, left))
-        right_fi = rpm.fi(right_hdr)
-        try:
-            while right_fi.FN() != filename:
-                right_fi.next()
-        except StopIteration:
+        if filename not in right_indexes:
             raise KeyError('Entry %s not found in %s' % (filename, right))
-        if librpm.rpmfiCompare(_rpm.fiFromFi(left_fi), _rpm.fiFromFi(right_fi)) == 0:
+        # The Python bindings cannot move an rpm.fi to a given file, but the 
+        # C API can, and the rpm.fi methods then see the same position.
+        left_rpmfi = _rpm.fiFromFi(left_fi)
+        right_rpmfi = _rpm.fiFromFi(right_fi)
+        librpm.rpmfiSetFX(left_rpmfi, left_indexes[filename])
+        librpm.rpmfiSetFX(right_rpmfi, right_indexes[filename])
+        if librpm.rpmfiCompare(left_rpmfi, right_rpmfi) == 0:
             logger.debug('Conflict on %s between %s and %s permitted because files match',
                     filename, left, right)
             return True
@@ -380,20 +1787,53 @@ class DependencyAnalyzer(object):
         :return: List of str describing each conflict found
                  (or empty list if no conflicts were found)
         """
-        solver = self.pool.Solver()
+        self._ensure_filelists()
         problems = []
-        for solvable in self.solvables:
-            logger.debug('Checking all files in %s for conflicts', solvable)
-            filenames = set(self._files_in_solvable(solvable))
+        if self._file_indexes is None:
             # In libsolv, iterating all solvables is fast, and listing all 
             # files in a solvable is fast, but finding solvables which contain 
-            # a given file is *very slow* (see bug 1465736).
-            # Hence this approach, where we visit each solvable and use Python 
-            # set operations to look for any overlapping filenames.
-            for conflicting in self.pool.solvables:
+            # a given file is *very slow* (see bug 1465736). So instead we 
+            # look up the paths in the packages under test in our own 
+            # indexes of the file lists.
+            paths = set()
+            for solvable in self.solvables:
+                paths.update(self._files_in_solvable(solvable))
+            self._file_indexes = self._file_indexes_for(paths)
+        for solvable in self.solvables:
+            logger.debug('Checking all files in %s for conflicts', solvable)
+            dirs, ghosts = self._local_file_types(solvable)
+            # rpm never considers a ghost file to be conflicting
+            filenames = set(self._files_in_solvable(solvable)) - ghosts
+            candidates = defaultdict(set)
+            for filename in filenames:
+                for index in self._file_indexes:
+                    for solvid in index.get(filename, ()):
+                        candidates[solvid].add(filename)
+            # Candidates are visited with the packages under test first, then 
+            # in pool order, which decides the remote package checked for 
+            # each filename (see below).
+            commandline = set(s.id for s in self.solvables)
+            for solvid in sorted(candidates,
+                    key=lambda solvid: (solvid not in commandline, solvid)):
+                conflicting = self.pool.solvables[solvid]
                 if conflicting == solvable:
                     continue
-                conflict_filenames = filenames.intersection(self._files_in_solvable(conflicting))
+                conflict_filenames = filenames.intersection(candidates[solvid])
+                if conflict_filenames and conflicting.repo != self.commandline_repo:
+                    # The cached indexes only store a hash of each path
+                    conflicting_files = self._files_in_solvable(conflicting)
+                    conflict_filenames.intersection_update(conflicting_files)
+                    # Directories are shared between many packages. The repo 
+                    # file lists do not tell us which entries are directories, 
+                    # but anything which contains other entries must be one. 
+                    # Settle those here, rather than downloading the package.
+                    shared_dirs = conflict_filenames & dirs
+                    if shared_dirs:
+                        shared_dirs.intersection_update(posixpath.dirname(f)
+                                for f in conflicting_files)
+                        for filename in shared_dirs:
+                            logger.debug('Directory %s is shared with %s', filename, conflicting)
+                        conflict_filenames -= shared_dirs
                 if not conflict_filenames:
                     continue
                 if not self._packages_can_be_installed_together(solvable, conflicting):
@@ -419,22 +1859,44 @@ class DependencyAnalyzer(object):
                         logger.debug('Skipping further checks on %s '
                                 'to save network bandwidth', filename)
                         filenames.remove(filename)
+        logger.debug('Header cache hits/misses: %d/%d, files cache hits/misses: %d/%d',
+                self.header_cache.hits, self.header_cache.misses,
+                self.files_cache.hits, self.files_cache.misses)
+        logger.debug('Solves saved by reusing install results: %d', self.solves_saved)
         return sorted(problems)
 
-    def find_upgrade_problems(self):
+    def find_upgrade_problems(self, engine='targeted'):
         """
         Checks for any package in the repos which would upgrade or obsolete the 
         packages under test.
 
+        :param engine: If "targeted", look up the repo packages with the same 
+                       name and a higher version, or which obsolete a package 
+                       under test, and only solve an update of the packages 
+                       under test which have any. If "distupgrade", solve 
+                       a distupgrade of the whole pool, which also warns 
+                       about pre-existing problems in unrelated packages.
         :return: List of str describing each upgrade problem found (or 
                  empty list if no problems were found)
         """
-        # Pretend the packages under test are installed, then solve a distupgrade.
+        if engine not in ('targeted', 'distupgrade'):
+            raise ValueError('Unknown upgrade engine %r' % engine)
+        if engine == 'targeted':
+            targets = [solvable for solvable in self.solvables
+                    if self._upgrade_candidates(solvable)]
+            logger.debug('Found upgrade candidates for %d of %d packages under test',
+                    len(targets), len(self.solvables))
+            if not targets:
+                return []
+            jobs = [self.pool.Job(solv.Job.SOLVER_SOLVABLE | solv.Job.SOLVER_UPDATE,
+                    solvable.id) for solvable in targets]
+        else:
+            jobs = self.pool.Selection_all().jobs(solv.Job.SOLVER_UPDATE)
+        # Pretend the packages under test are installed, then solve an update.
         # If any package under test would be erased, then it means some other 
         # package in the repos is better than it and we have a problem.
         self.pool.installed = self.commandline_repo
         try:
-            jobs = self.pool.Selection_all().jobs(solv.Job.SOLVER_UPDATE)
             solver = self.pool.Solver()
             solver.set_flag(solver.SOLVER_FLAG_ALLOW_UNINSTALL, True)
             solver_problems = solver.solve(jobs)
@@ -462,3 +1924,22 @@ class DependencyAnalyzer(object):
             return problems
         finally:
             self.pool.installed = None
+
+    def _upgrade_candidates(self, solvable):
+        """
+        Returns a list of the repo packages which might upgrade or obsolete 
+        the given package under test: those with the same name and a higher 
+        epoch-version-release, and those with an Obsoletes matching it. Only 
+        a solve can tell whether they really would.
+        """
+        pool = self.pool
+        candidates = [pool.solvables[solvid] for solvid
+                in self._solvable_table().newer_than(solvable)]
+        obsoletes = pool.str2id('solvable:obsoletes')
+        if hasattr(pool, 'whatmatchessolvable'):
+            candidates.extend(pool.whatmatchessolvable(obsoletes, solvable, 0))
+        else:
+            for dep in solvable.lookup_deparray(pool.str2id('solvable:provides')):
+                candidates.extend(pool.whatmatchesdep(obsoletes, dep.id, 0))
+        return [other for other in candidates
+                if other.repo != self.commandline_repo and pool.isknownarch(other.archid)]
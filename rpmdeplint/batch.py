@@ -0,0 +1,187 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Checking of many independent package sets against the same repos, for
+``rpmdeplint batch``.
+
+The manifest is either a JSON array of package sets, or newline-delimited
+JSON with one package set per line. Each package set is an object with these
+keys:
+
+``name``
+    Name of the package set, which is repeated in its result (required).
+    Names must be unique within the manifest.
+``rpms``
+    List of paths to the RPM packages in the set (required).
+``checks``
+    List of the checks to perform, named after their commands. The default
+    is every check performed by ``rpmdeplint check``.
+``full_repoclosure``, ``repoclosure_engine``, ``upgrade_engine``
+    Options for the checks, as for the corresponding command line options.
+    The defaults are those given on the command line.
+
+The result for each package set is an object with its ``name`` and
+a ``status``, which is the exit status that checking it on its own would
+have: 0 if no problems were found, 3 if problems were found, or 1 if the
+checks could not be performed. Its ``problems`` are an object with a list of
+str problems for each check performed. If the status is 1, ``error``
+describes what went wrong instead.
+"""
+
+from __future__ import absolute_import
+
+import copy
+import json
+import logging
+import multiprocessing
+import six
+from rpmdeplint import DependencyAnalyzer, UnreadablePackageError
+from rpmdeplint.repodata import PackageDownloadError
+
+logger = logging.getLogger(__name__)
+
+#: Options which a package set may override
+package_set_options = ['full_repoclosure', 'repoclosure_engine', 'upgrade_engine']
+
+
+def read_manifest(f, defaults):
+    """
+    Reads the package sets from a manifest in the given text file, checking
+    that each one is valid. Raises ValueError if any is not.
+
+    :param defaults: :py:class:`argparse.Namespace` of the command line
+                     options, which supply the defaults for each package set
+    :return: List of (name, list of RPM paths, list of checks,
+             :py:class:`argparse.Namespace` of options) for each package set
+    """
+    # delayed import to avoid circular dependency
+    from rpmdeplint.cli import all_checks
+
+    text = f.read()
+    if text.lstrip().startswith('['):
+        try:
+            entries = list(enumerate(json.loads(text), 1))
+        except ValueError as e:
+            raise ValueError('Invalid manifest: %s' % e)
+    else:
+        entries = [(number, line) for number, line in enumerate(text.splitlines(), 1)
+                if line.strip()]
+    package_sets = []
+    names = set()
+    for number, entry in entries:
+        try:
+            if isinstance(entry, six.string_types):
+                entry = json.loads(entry)
+            if not isinstance(entry, dict):
+                raise ValueError('not an object')
+            for key in ['name', 'rpms']:
+                if key not in entry:
+                    raise ValueError('missing %s' % key)
+            name = entry['name']
+            if not isinstance(name, six.string_types):
+                raise ValueError('name is not a string')
+            if name in names:
+                raise ValueError('duplicate name %s' % name)
+            rpms = entry['rpms']
+            if not isinstance(rpms, list) or not rpms:
+                raise ValueError('rpms is not a non-empty list')
+            checks = entry.get('checks', all_checks)
+            unknown = [check for check in checks if check not in all_checks]
+            if unknown:
+                raise ValueError('unknown checks %s' % ', '.join(unknown))
+            args = copy.copy(defaults)
+            # Package sets are checked in parallel instead
+            args.jobs = 1
+            for option in package_set_options:
+                if option in entry:
+                    setattr(args, option, entry[option])
+        except (TypeError, ValueError) as e:
+            raise ValueError('Invalid package set %d in manifest: %s' % (number, e))
+        names.add(name)
+        package_sets.append((name, rpms, checks, args))
+    return package_sets
+
+
+def check_package_set(repo_set, rpms, checks, args):
+    """
+    Performs the given checks on a set of packages against the repo set,
+    with an analyzer of its own.
+
+    :return: A dict with the ``status`` of the checks and their ``problems``,
+             or the ``error`` which prevented them
+    """
+    # delayed import to avoid circular dependency
+    from rpmdeplint.cli import run_checks
+
+    try:
+        with DependencyAnalyzer(repo_set, rpms) as analyzer:
+            results = run_checks(analyzer, checks, args)
+    except (UnreadablePackageError, PackageDownloadError, ValueError) as e:
+        return {'status': 1, 'error': u'%s' % e}
+    except Exception as e:
+        logger.exception('Failed to perform checks for %r', rpms)
+        return {'status': 1, 'error': u'%s' % e}
+    problems = dict(results)
+    failed = any(problems.values())
+    return {'status': 3 if failed else 0, 'problems': problems}
+
+
+def _check_package_set_record(repo_set, package_set):
+    name, rpms, checks, args = package_set
+    record = check_package_set(repo_set, rpms, checks, args)
+    record['name'] = name
+    return record
+
+
+#: Repo set inherited by forked worker processes, see check_package_sets()
+_worker_repo_set = None
+
+
+def _check_in_worker(package_set):
+    return _check_package_set_record(_worker_repo_set, package_set)
+
+
+def check_package_sets(repo_set, package_sets, jobs=1):
+    """
+    Checks each of the given package sets (as returned by
+    :py:func:`read_manifest`) in isolation against the repo set, and yields
+    a result record for each one as soon as it is ready, in the order of the
+    package sets.
+
+    :param jobs: Number of worker processes to check package sets in. The
+                 workers are forked after the repos are loaded, so they share
+                 them rather than loading them again.
+    """
+    global _worker_repo_set
+    if any('check-conflicts' in checks or 'check-repoclosure' in checks
+            for _, _, checks, _ in package_sets):
+        # Load the file lists up front, so that the workers inherit them 
+        # instead of each loading them again.
+        repo_set.ensure_filelists()
+    if any('check-conflicts' in checks for _, _, checks, _ in package_sets):
+        for name in repo_set.repos_by_name:
+            repo_set._file_index(name)
+    if jobs == 1 or len(package_sets) < 2:
+        for package_set in package_sets:
+            yield _check_package_set_record(repo_set, package_set)
+        return
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing # Python 2 always forks
+    logger.debug('Checking %d package sets in %d processes', len(package_sets), jobs)
+    _worker_repo_set = repo_set
+    workers = context.Pool(min(jobs, len(package_sets)))
+    try:
+        for record in workers.imap(_check_in_worker, package_sets):
+            yield record
+        workers.close()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+        _worker_repo_set = None
@@ -6,47 +6,209 @@
 
 from __future__ import absolute_import
 
+import os
 import sys
+import io
+import json
 import logging
 import argparse
-import pkg_resources
-from rpmdeplint import DependencyAnalyzer, UnreadablePackageError
-from rpmdeplint.repodata import Repo, RepoDownloadError, PackageDownloadError
+import signal
+import multiprocessing
+from rpmdeplint import DependencyAnalyzer, RepoSet, UnreadablePackageError
+from rpmdeplint.repodata import Repo, RepoDownloadError, PackageDownloadError, \
+        parse_metadata_expire, cache_index, cache_expiry_seconds, cache_size_budget
 
 logger = logging.getLogger(__name__)
 
-version = pkg_resources.require('rpmdeplint')[0].version
 
-def cmd_check(args):
+def get_version():
     """
-    Performs all checks on the given packages.
+    Returns the installed version of rpmdeplint. It is only looked up when 
+    needed, because pkg_resources takes a long time to import and scan every 
+    installed distribution.
     """
-    failed = False
-    with dependency_analyzer_from_args(args) as analyzer:
+    try:
+        from importlib.metadata import version # Python 3.8+
+    except ImportError:
+        import pkg_resources
+        return pkg_resources.require('rpmdeplint')[0].version
+    return version('rpmdeplint')
+
+
+class VersionAction(argparse.Action):
+    """
+    Like argparse's ``version`` action, but looks up the version only when 
+    the option is given.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+            default=argparse.SUPPRESS, help=None):
+        super(VersionAction, self).__init__(option_strings=option_strings,
+                dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        sys.stdout.write('%s %s\n' % (parser.prog, get_version()))
+        parser.exit()
+
+#: Checks performed by the check command, in the order they are reported
+all_checks = ['check-sat', 'check-repoclosure', 'check-conflicts', 'check-upgrade']
+
+check_headings = {
+    'check-sat': u'Problems with dependency set',
+    'check-repoclosure': u'Dependency problems with repos',
+    'check-conflicts': u'Undeclared file conflicts',
+    'check-upgrade': u'Upgrade problems',
+}
+
+
+def run_check(analyzer, check, args):
+    """
+    Performs a single check (named after its command) on the analyzer, and 
+    returns the list of str problems it found.
+    """
+    if check == 'check-sat':
         logger.debug('Performing satisfiability check (check-sat)')
-        ok, result = analyzer.try_to_install_all()
-        if not ok:
-            sys.stderr.write(u'Problems with dependency set:\n')
-            sys.stderr.write(u'\n'.join(result.overall_problems) + u'\n')
-            failed = True
+        _, result = analyzer.try_to_install_all()
+        return result.overall_problems
+    elif check == 'check-repoclosure':
         logger.debug('Performing repoclosure check (check-repoclosure)')
-        problems = analyzer.find_repoclosure_problems()
-        if problems:
-            sys.stderr.write(u'Dependency problems with repos:\n')
-            sys.stderr.write(u'\n'.join(problems) + u'\n')
-            failed = True
+        return analyzer.find_repoclosure_problems(full=args.full_repoclosure,
+                jobs=args.jobs, engine=args.repoclosure_engine)
+    elif check == 'check-conflicts':
         logger.debug('Performing file conflict check (check-conflicts)')
-        conflicts = analyzer.find_conflicts()
-        if conflicts:
-            sys.stderr.write(u'Undeclared file conflicts:\n')
-            sys.stderr.write(u'\n'.join(conflicts) + u'\n')
-            failed = True
+        return analyzer.find_conflicts()
+    elif check == 'check-upgrade':
         logger.debug('Performing upgrade check (check-upgrade)')
-        problems = analyzer.find_upgrade_problems()
-        if problems:
-            sys.stderr.write(u'Upgrade problems:\n')
-            sys.stderr.write(u'\n'.join(problems) + u'\n')
-            failed = True
+        return analyzer.find_upgrade_problems(engine=args.upgrade_engine)
+    raise ValueError('Unknown check %s' % check)
+
+
+class _RecordingHandler(logging.Handler):
+    """
+    Keeps the log records of a check performed in a forked process, so that 
+    they can be sent to the parent and handled there in the order of the 
+    checks. Records logged by processes forked in turn by the check (for 
+    --jobs) are passed on to the original handlers instead.
+    """
+
+    def __init__(self, handlers):
+        # Records which none of the handlers would emit are not worth keeping. 
+        # Without handlers, logging falls back to warnings and above.
+        logging.Handler.__init__(self, min([handler.level for handler in handlers]
+                or [logging.WARNING]))
+        self.handlers = handlers
+        self.pid = os.getpid()
+        self.records = []
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            return
+        # The arguments and traceback might not be picklable
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _send_check_result(conn, analyzer, check, args):
+    root_logger = logging.getLogger()
+    recorder = _RecordingHandler(root_logger.handlers)
+    root_logger.handlers = [recorder]
+    try:
+        result = (True, run_check(analyzer, check, args))
+    except Exception as e:
+        result = (False, e)
+    try:
+        conn.send(result + (recorder.records,))
+    except Exception:
+        # The exception could not be pickled
+        conn.send((False, RuntimeError(u'%s failed: %s' % (check, result[1])),
+                recorder.records))
+    conn.close()
+
+
+def run_checks(analyzer, checks, args, parallel=False):
+    """
+    Performs the given checks (named after their commands) on the analyzer, 
+    in the order of :py:data:`all_checks`. The repoclosure and upgrade 
+    options are taken from *args*.
+
+    :param parallel: If True, perform the checks at the same time, each in 
+                     a process of its own. The processes are forked, so they 
+                     share the loaded repos with this one. The results, and 
+                     the messages logged by each check, are the same and in 
+                     the same order as performing the checks one after 
+                     another.
+    :return: List of (check, list of str problems) for each check performed
+    """
+    checks = [check for check in all_checks if check in checks]
+    results = []
+    if parallel and 'check-sat' in checks and len(checks) > 2:
+        # Solving each package under test on its own is cheap, and the 
+        # result is reused by the other checks, so do it once before forking.
+        results.append(('check-sat', run_check(analyzer, 'check-sat', args)))
+        checks.remove('check-sat')
+    if not parallel or len(checks) < 2:
+        for check in checks:
+            results.append((check, run_check(analyzer, check, args)))
+        return results
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing # Python 2 always forks
+    logger.debug('Performing %d checks in parallel', len(checks))
+    # Anything still buffered would otherwise be written again by each child
+    sys.stdout.flush()
+    sys.stderr.flush()
+    workers = []
+    finished = False
+    try:
+        for check in checks:
+            conn, child_conn = context.Pipe(duplex=False)
+            # Not a daemon, so that the repoclosure check can fork workers of 
+            # its own for --jobs
+            process = context.Process(target=_send_check_result,
+                    args=(child_conn, analyzer, check, args))
+            process.start()
+            child_conn.close()
+            workers.append((check, process, conn))
+        for check, process, conn in workers:
+            try:
+                ok, result, records = conn.recv()
+            except EOFError:
+                raise RuntimeError(u'%s exited unexpectedly' % check)
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            if not ok:
+                raise result
+            results.append((check, result))
+        finished = True
+    finally:
+        for check, process, conn in workers:
+            if not finished and process.is_alive():
+                process.terminate()
+            process.join()
+            conn.close()
+    return results
+
+
+def cmd_check(args):
+    """
+    Performs all checks on the given packages.
+    """
+    failed = False
+    with dependency_analyzer_from_args(args) as analyzer:
+        for check, problems in run_checks(analyzer, all_checks, args,
+                parallel=args.parallel_checks):
+            if problems:
+                sys.stderr.write(check_headings[check] + u':\n')
+                sys.stderr.write(u'\n'.join(problems) + u'\n')
+                failed = True
     return 3 if failed else 0
 
 
@@ -71,7 +233,8 @@ def cmd_check_repoclosure(args):
     be satisfied, when the given packages are included.
     """
     with dependency_analyzer_from_args(args) as analyzer:
-        problems = analyzer.find_repoclosure_problems()
+        problems = analyzer.find_repoclosure_problems(full=args.full_repoclosure,
+                jobs=args.jobs, engine=args.repoclosure_engine)
     if problems:
         sys.stderr.write(u'Dependency problems with repos:\n')
         sys.stderr.write(u'\n'.join(problems) + u'\n')
@@ -98,7 +261,7 @@ def cmd_check_upgrade(args):
     package in the repos.
     """
     with dependency_analyzer_from_args(args) as analyzer:
-        problems = analyzer.find_upgrade_problems()
+        problems = analyzer.find_upgrade_problems(engine=args.upgrade_engine)
     if problems:
         sys.stderr.write(u'Upgrade problems:\n')
         sys.stderr.write(u'\n'.join(problems) + u'\n')
@@ -128,6 +291,112 @@ def cmd_list_deps(args):
     return 0
 
 
+def format_size(size):
+    for unit in ['bytes', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TiB'
+    if unit == 'bytes':
+        return u'%d %s' % (size, unit)
+    return u'%.1f %s' % (size, unit)
+
+
+def cmd_cache(args):
+    """
+    Manages the cache of downloaded repodata and packages. The "stats" action 
+    shows the size of the cache, "prune" removes expired entries and the least 
+    recently used entries beyond the size budget, and "verify" checks the 
+    contents of each entry against its checksum and removes any which are 
+    corrupted.
+    """
+    index = cache_index()
+    try:
+        budget = cache_size_budget()
+    except ValueError as e:
+        sys.stderr.write(u'RPMDEPLINT_CACHE_SIZE: %s\n' % e)
+        return 1
+    if args.action == 'stats':
+        sizes = {}
+        counts = {}
+        for path, size, last_used, kind in index.entries():
+            sizes[kind] = sizes.get(kind, 0) + size
+            counts[kind] = counts.get(kind, 0) + 1
+        sys.stdout.write(u'Cache directory: %s\n' % index.base_path)
+        for kind in sorted(counts):
+            sys.stdout.write(u'%s: %d entries, %s\n'
+                    % (kind, counts[kind], format_size(sizes[kind])))
+        sys.stdout.write(u'Total: %d entries, %s\n'
+                % (sum(counts.values()), format_size(sum(sizes.values()))))
+        sys.stdout.write(u'Size budget: %s\n'
+                % (format_size(budget) if budget is not None else u'unlimited'))
+        sys.stdout.write(u'Expiry: %d seconds\n' % cache_expiry_seconds())
+    elif args.action == 'prune':
+        index.rescan()
+        removed = index.prune(cache_expiry_seconds(), budget)
+        sys.stdout.write(u'Removed %d cache entries\n' % removed)
+    elif args.action == 'verify':
+        corrupted = index.verify()
+        if corrupted:
+            sys.stderr.write(u'Removed corrupted cache entries:\n')
+            sys.stderr.write(u'\n'.join(corrupted) + u'\n')
+            return 3
+    return 0
+
+
+def cmd_serve(args):
+    """
+    Runs a server which keeps repos loaded, and performs checks on packages 
+    for requests received on a Unix socket. Each request is a line of JSON, 
+    and is answered with a line of JSON. The repos given as options are used 
+    for requests which do not name their own.
+    """
+    from rpmdeplint.server import CheckServer
+    server = CheckServer(args.socket, args, max_repo_sets=args.max_repo_sets,
+            reload_after=args.reload_after)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info('Listening on %s', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def cmd_batch(args):
+    """
+    Checks many independent sets of packages against the same repos, which 
+    are loaded only once. The package sets, and the checks to perform on 
+    each, are read from a manifest of JSON objects. A result is written to 
+    stdout as a line of JSON for each package set, in the order of the 
+    manifest, as soon as it is ready.
+    """
+    from rpmdeplint.batch import read_manifest, check_package_sets
+    try:
+        if args.manifest == '-':
+            package_sets = read_manifest(sys.stdin, args)
+        else:
+            with io.open(args.manifest, encoding='utf8') as f:
+                package_sets = read_manifest(f, args)
+    except (IOError, ValueError) as e:
+        sys.stderr.write(u'%s\n' % e)
+        return 1
+    status = 0
+    with RepoSet(repos_from_args(args), arch=args.arch,
+            max_parallel_downloads=args.max_parallel_downloads) as repo_set:
+        for record in check_package_sets(repo_set, package_sets, jobs=args.jobs):
+            sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+            sys.stdout.flush()
+            if record['status'] == 1:
+                status = 1
+            elif record['status'] == 3 and status == 0:
+                status = 3
+    return status
+
+
 def log_to_stream(stream, level=logging.WARNING):
     stream_handler = logging.StreamHandler(stream)
     stream_handler.setLevel(level)
@@ -135,15 +404,25 @@ def log_to_stream(stream, level=logging.WARNING):
     logging.getLogger().handlers = [stream_handler]
 
 
-def dependency_analyzer_from_args(args):
+def repos_from_args(args):
     repos = []
     if args.repos_from_system:
         repos.extend(Repo.from_yum_config())
     repos.extend(args.repos)
+    if args.metadata_expire is not None:
+        for repo in repos:
+            repo.metadata_expire = args.metadata_expire
+    return repos
+
+
+def dependency_analyzer_from_args(args):
+    repos = repos_from_args(args)
     rpms = list(args.rpms)
     arch = args.arch
 
-    return DependencyAnalyzer(repos, rpms, arch=arch)
+    return DependencyAnalyzer(repos, rpms, arch=arch,
+            max_parallel_downloads=args.max_parallel_downloads,
+            load_filelists=args.load_filelists)
 
 
 def comma_separated_repo(value):
@@ -153,9 +432,53 @@ def comma_separated_repo(value):
     return Repo(*value.split(',', 1))
 
 
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+                '%r is not a positive integer' % value)
+    return number
+
+
+def metadata_expire(value):
+    try:
+        return parse_metadata_expire(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def add_common_dependency_analyzer_args(parser):
     parser.add_argument('rpms', metavar='RPMPATH', nargs='+',
             help='Path to an RPM package to be checked')
+    add_common_repo_args(parser)
+
+
+def add_repoclosure_args(parser, jobs=True):
+    parser.add_argument('--full-repoclosure', action='store_true',
+            help='Check every package in the repos, not only those affected '
+                 'by the packages under test')
+    if jobs:
+        parser.add_argument('-j', '--jobs', metavar='N', type=positive_int, default=1,
+                help='Check repo packages in N processes at once [default: 1]')
+    parser.add_argument('--repoclosure-engine', choices=['bulk', 'single'],
+            default='bulk',
+            help='Find installable repo packages in bulk before solving for '
+                 'the rest one at a time, or solve for every package one at '
+                 'a time [default: bulk]')
+
+
+def add_upgrade_args(parser):
+    parser.add_argument('--upgrade-engine', choices=['targeted', 'distupgrade'],
+            default='targeted',
+            help='Only solve for packages under test which have upgrade '
+                 'candidates in the repos, or solve a distupgrade of every '
+                 'package [default: targeted]')
+
+
+def add_common_repo_args(parser):
     parser.add_argument('-r', '--repo', metavar='NAME,URL',
             type=comma_separated_repo,
             action='append', dest='repos', default=[],
@@ -164,6 +487,13 @@ def add_common_dependency_analyzer_args(parser):
             help='Test against system repos from /etc/yum.repos.d/')
     parser.add_argument('-a', '--arch', dest='arch', default=None,
             help='Limit dependency resolution to ARCH packages [default: any arch]')
+    parser.add_argument('--max-parallel-downloads', metavar='N',
+            type=positive_int, default=4,
+            help='Download repodata from at most N repos at once [default: 4]')
+    parser.add_argument('--metadata-expire', metavar='AGE',
+            type=metadata_expire, default=None,
+            help='Use cached repodata younger than AGE without checking '
+                 'the repos for changes [default: from repo config, or 0]')
 
 
 def validate_common_dependency_analyzer_args(parser, args):
@@ -179,7 +509,8 @@ def main():
             'RPM packages in the context of their dependency graph.', prog='rpmdeplint')
     parser.add_argument('--debug', action='store_true',
             help='Show detailed progress messages')
-    parser.add_argument('--version', action='version', version='%(prog)s ' + version)
+    parser.add_argument('--version', action=VersionAction,
+            help="show program's version number and exit")
 
     subparsers = parser.add_subparsers(dest='subcommand', title='subcommands')
     subparsers.required = True
@@ -188,43 +519,90 @@ def main():
             help='Perform all checks',
             description=cmd_check.__doc__)
     add_common_dependency_analyzer_args(parser_check)
-    parser_check.set_defaults(func=cmd_check)
+    add_repoclosure_args(parser_check)
+    add_upgrade_args(parser_check)
+    parser_check.add_argument('--serial-checks', action='store_false',
+            dest='parallel_checks',
+            help='Perform the checks one after another, instead of at the '
+                 'same time in separate processes')
+    # Only the file conflict check needs the complete file lists up front
+    parser_check.set_defaults(func=cmd_check, load_filelists=True)
 
     parser_check_sat = subparsers.add_parser('check-sat',
             help='Check that dependencies can be satisfied',
             description=cmd_check_sat.__doc__)
     add_common_dependency_analyzer_args(parser_check_sat)
-    parser_check_sat.set_defaults(func=cmd_check_sat)
+    parser_check_sat.set_defaults(func=cmd_check_sat, load_filelists=False)
 
     parser_check_repoclosure = subparsers.add_parser('check-repoclosure',
             help='Check that repo dependencies can still be satisfied',
             description=cmd_check_repoclosure.__doc__)
     add_common_dependency_analyzer_args(parser_check_repoclosure)
-    parser_check_repoclosure.set_defaults(func=cmd_check_repoclosure)
+    add_repoclosure_args(parser_check_repoclosure)
+    parser_check_repoclosure.set_defaults(func=cmd_check_repoclosure, load_filelists=True)
 
     parser_check_conflicts = subparsers.add_parser('check-conflicts',
             help='Check for undeclared file conflicts',
             description=cmd_check_conflicts.__doc__)
     add_common_dependency_analyzer_args(parser_check_conflicts)
-    parser_check_conflicts.set_defaults(func=cmd_check_conflicts)
+    parser_check_conflicts.set_defaults(func=cmd_check_conflicts, load_filelists=True)
 
     parser_check_upgrade = subparsers.add_parser('check-upgrade',
             help='Check package is an upgrade',
             description=cmd_check_upgrade.__doc__)
     add_common_dependency_analyzer_args(parser_check_upgrade)
-    parser_check_upgrade.set_defaults(func=cmd_check_upgrade)
+    add_upgrade_args(parser_check_upgrade)
+    parser_check_upgrade.set_defaults(func=cmd_check_upgrade, load_filelists=False)
 
     parser_list_deps = subparsers.add_parser('list-deps',
             help='List all packages needed to satisfy dependencies',
             description=cmd_list_deps.__doc__)
     add_common_dependency_analyzer_args(parser_list_deps)
-    parser_list_deps.set_defaults(func=cmd_list_deps)
+    parser_list_deps.set_defaults(func=cmd_list_deps, load_filelists=False)
+
+    parser_serve = subparsers.add_parser('serve',
+            help='Keep repos loaded and perform checks for requests on a socket',
+            description=cmd_serve.__doc__)
+    parser_serve.add_argument('--socket', metavar='PATH', required=True,
+            help='Path of the Unix socket to listen on')
+    add_common_repo_args(parser_serve)
+    add_repoclosure_args(parser_serve)
+    add_upgrade_args(parser_serve)
+    parser_serve.add_argument('--max-repo-sets', metavar='N', type=positive_int,
+            default=4,
+            help='Keep at most N different sets of repos loaded [default: 4]')
+    parser_serve.add_argument('--reload-after', metavar='AGE', type=metadata_expire,
+            default=3600,
+            help='Load repos again when they were loaded more than AGE ago '
+                 '[default: 1h]')
+    parser_serve.set_defaults(func=cmd_serve, load_filelists=False)
+
+    parser_batch = subparsers.add_parser('batch',
+            help='Check many package sets against the same repos',
+            description=cmd_batch.__doc__)
+    parser_batch.add_argument('manifest', metavar='MANIFEST',
+            help='Path to a manifest of the package sets to check, '
+                 'or - to read it from stdin')
+    add_common_repo_args(parser_batch)
+    add_repoclosure_args(parser_batch, jobs=False)
+    add_upgrade_args(parser_batch)
+    parser_batch.add_argument('-j', '--jobs', metavar='N', type=positive_int, default=1,
+            help='Check N package sets at once in separate processes [default: 1]')
+    parser_batch.set_defaults(func=cmd_batch, load_filelists=False)
+
+    parser_cache = subparsers.add_parser('cache',
+            help='Show, prune or verify the cache',
+            description=cmd_cache.__doc__)
+    parser_cache.add_argument('action', choices=['stats', 'prune', 'verify'],
+            help='Action to perform on the cache')
+    parser_cache.set_defaults(func=cmd_cache)
 
     args = parser.parse_args()
     logging.getLogger().setLevel(logging.DEBUG)
     log_to_stream(sys.stderr, level=logging.DEBUG if args.debug else logging.WARNING)
 
-    validate_common_dependency_analyzer_args(parser, args)
+    if args.func not in (cmd_cache, cmd_serve):
+        validate_common_dependency_analyzer_args(parser, args)
 
     try:
         return args.func(args)
@@ -234,5 +612,6 @@ def main():
         sys.stderr.write('%s\n' % exc)
         return 1
 
+
 if __name__ == '__main__':
     sys.exit(main())
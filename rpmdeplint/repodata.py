@@ -7,6 +7,8 @@
 from __future__ import absolute_import
 
 import os
+import json
+import hashlib
 try:
     from os import scandir # Python 3.5+
 except ImportError:
@@ -14,15 +16,33 @@ except ImportError:
 import shutil
 import logging
 import tempfile
-import requests
 import errno
 import glob
 import time
+import struct
+import sqlite3
+import threading
 from six.moves import configparser
-import librepo
 
 logger = logging.getLogger(__name__)
-requests_session = requests.Session()
+
+# requests and librepo are slow to import, and most commands only need them 
+# once they download something, so they are imported where they are used.
+_requests_session = None
+_requests_session_lock = threading.Lock()
+
+
+def requests_session():
+    """
+    Returns the :py:class:`requests.Session` shared by all downloads, creating 
+    it the first time.
+    """
+    global _requests_session
+    with _requests_session_lock:
+        if _requests_session is None:
+            import requests
+            _requests_session = requests.Session()
+        return _requests_session
 
 
 REPO_CACHE_DIR = os.path.join(os.sep, 'var', 'tmp')
@@ -41,36 +61,79 @@ class RepoDownloadError(Exception):
     """
     pass
 
-def get_yumvars():
-    # This is not all the yumvars, but hopefully good enough...
+#: Arches belonging to each base arch, as used for the $basearch yum variable 
+#: (from dnf.rpm._BASEARCH_MAP)
+_basearch_arches = [
+    ('aarch64', ['aarch64']),
+    ('alpha', ['alpha', 'alphaev4', 'alphaev45', 'alphaev5', 'alphaev56',
+               'alphaev6', 'alphaev67', 'alphaev68', 'alphaev7', 'alphapca56']),
+    ('arm', ['armv5tejl', 'armv5tel', 'armv5tl', 'armv6l', 'armv7l', 'armv8l']),
+    ('armhfp', ['armv6hl', 'armv7hl', 'armv7hnl', 'armv8hl']),
+    ('i386', ['i386', 'athlon', 'geode', 'i486', 'i586', 'i686']),
+    ('ia64', ['ia64']),
+    ('mips', ['mips']),
+    ('mipsel', ['mipsel']),
+    ('mips64', ['mips64']),
+    ('mips64el', ['mips64el']),
+    ('ppc', ['ppc']),
+    ('ppc64', ['ppc64', 'ppc64iseries', 'ppc64p7', 'ppc64pseries']),
+    ('ppc64le', ['ppc64le']),
+    ('riscv64', ['riscv64']),
+    ('s390', ['s390']),
+    ('s390x', ['s390x']),
+    ('sh3', ['sh3']),
+    ('sh4', ['sh4', 'sh4a']),
+    ('sparc', ['sparc', 'sparc64', 'sparc64v', 'sparcv8', 'sparcv9', 'sparcv9v']),
+    ('x86_64', ['x86_64', 'amd64', 'ia32e']),
+]
+_basearches = dict((arch, basearch)
+        for basearch, arches in _basearch_arches for arch in arches)
 
-    try:
-        import dnf.conf, dnf.rpm
-    except ImportError:
-        pass
-    else:
-        installroot = ''
-        subst = dnf.conf.Conf().substitutions
-        subst['releasever'] = dnf.rpm.detect_releasever(installroot)
-        return subst
 
+def _detect_releasever():
+    """
+    Returns the release version of the installed system, from the package in 
+    the RPM database which provides system-release(releasever), the same way 
+    as dnf. Returns None if it cannot be found.
+    """
     try:
-        import yum, yum.config, rpmUtils
+        import rpm
     except ImportError:
-        pass
-    else:
-        return {
-            'arch': rpmUtils.arch.getCanonArch(),
-            'basearch': rpmUtils.arch.getBaseArch(),
-            'releasever': yum.config._getsysver('/',
-                ['system-release(releasever)', 'redhat-release']),
-        }
-
-    # Probably not going to work but there's not much else we can do...
+        return None
+    ts = rpm.TransactionSet('/')
+    for provide in ['system-release(releasever)', 'redhat-release']:
+        try:
+            headers = list(ts.dbMatch('provides', provide))
+        except (TypeError, rpm.error):
+            continue
+        if not headers:
+            continue
+        hdr = headers[0]
+        releasever = hdr['version']
+        # The package can provide a different releasever than its version
+        try:
+            index = hdr[rpm.RPMTAG_PROVIDENAME].index(provide)
+            flag = hdr[rpm.RPMTAG_PROVIDEFLAGS][index]
+            version = hdr[rpm.RPMTAG_PROVIDEVERSION][index]
+            if flag == rpm.RPMSENSE_EQUAL and version and hdr['name'] != provide:
+                releasever = version
+        except (ValueError, KeyError, IndexError):
+            pass
+        if isinstance(releasever, bytes) and not isinstance(releasever, str):
+            releasever = releasever.decode('utf8')
+        return releasever
+    return None
+
+
+def get_yumvars():
+    # This is not all the yumvars, but hopefully good enough...
+    # They are worked out the same way as dnf does, but without importing dnf 
+    # (or yum), which is much slower than the rest of rpmdeplint put together.
+    arch = os.uname()[4]
     return {
-        'arch': '$arch',
-        'basearch': '$basearch',
-        'releasever': '$releasever',
+        'arch': arch,
+        'basearch': _basearches.get(arch, arch),
+        'releasever': _detect_releasever() or '$releasever',
     }
 
 
@@ -80,6 +143,30 @@ def substitute_yumvars(s, yumvars):
     return s
 
 
+def parse_metadata_expire(value):
+    """
+    Parses a metadata expiry period in the same format as the Yum/DNF 
+    ``metadata_expire`` option: a number of seconds, optionally with a suffix 
+    of ``d``, ``h`` or ``m`` for days, hours or minutes, or ``never`` (or 
+    ``-1``) meaning the metadata never expires. Returns the number of seconds.
+    """
+    number = value.strip().lower()
+    if number in ('never', '-1'):
+        return float('inf')
+    multipliers = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    multiplier = 1
+    if number and number[-1] in multipliers:
+        multiplier = multipliers[number[-1]]
+        number = number[:-1]
+    try:
+        seconds = float(number) * multiplier
+    except ValueError:
+        raise ValueError('Invalid metadata_expire value %r' % value)
+    if seconds < 0:
+        raise ValueError('Invalid metadata_expire value %r' % value)
+    return seconds
+
+
 def cache_base_path():
     default_cache_home = os.path.join(os.path.expanduser('~'), '.cache')
     cache_home = os.environ.get('XDG_CACHE_HOME', default_cache_home)
@@ -90,25 +177,409 @@ def cache_entry_path(checksum):
     return os.path.join(cache_base_path(), checksum[:1], checksum[1:])
 
 
-def clean_cache():
-    expiry_time = time.time() - float(os.environ.get('RPMDEPLINT_EXPIRY_SECONDS', '604800'))
+def rpm_header_length(data):
+    """
+    Given the start of an RPM package, returns the number of bytes at the 
+    start of the package which make up the lead, the signature header and the 
+    main header -- that is, everything except the payload. Returns None if 
+    *data* is too short to tell yet.
+    """
+    lead_length = 96
+    intro_length = 16
+    if len(data) < 4:
+        return None
+    if data[:4] != b'\xed\xab\xee\xdb':
+        raise ValueError('Not an RPM package')
+    if len(data) < lead_length + intro_length:
+        return None
+    index_length, data_length = struct.unpack('>II',
+            data[lead_length + 8:lead_length + intro_length])
+    signature_length = intro_length + 16 * index_length + data_length
+    # The signature header is padded to a multiple of 8 bytes
+    signature_length += (8 - signature_length % 8) % 8
+    header_start = lead_length + signature_length
+    if len(data) < header_start + intro_length:
+        return None
+    index_length, data_length = struct.unpack('>II',
+            data[header_start + 8:header_start + intro_length])
+    return header_start + intro_length + 16 * index_length + data_length
+
+
+def repomd_cache_path(url):
+    """
+    Returns the directory where the most recently fetched repomd.xml for the 
+    repo at *url* is kept, as :file:`repodata/repomd.xml` under the directory.
+    """
+    key = hashlib.sha256(url.encode('utf8')).hexdigest()
+    return os.path.join(cache_base_path(), 'repomd', key)
+
+
+def parse_size(value):
+    """
+    Parses a size in bytes, optionally with a suffix of ``K``, ``M``, ``G`` or 
+    ``T`` (powers of 1024), as used for the ``RPMDEPLINT_CACHE_SIZE`` 
+    environment variable.
+    """
+    number = value.strip().upper()
+    if number.endswith('B'):
+        number = number[:-1]
+    multiplier = 1
+    for power, suffix in enumerate('KMGT', 1):
+        if number.endswith(suffix):
+            multiplier = 1024 ** power
+            number = number[:-1]
+            break
     try:
-        subdirs = scandir(cache_base_path())
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return # nothing to do
-        else:
-            raise
-    for subdir in subdirs:
-        # Should be a subdirectory named after the first checksum letter
-        if not subdir.is_dir(follow_symlinks=False):
-            continue
-        for entry in scandir(subdir.path):
+        size = int(float(number) * multiplier)
+    except ValueError:
+        raise ValueError('Invalid size %r' % value)
+    if size < 0:
+        raise ValueError('Invalid size %r' % value)
+    return size
+
+
+def cache_expiry_seconds():
+    return float(os.environ.get('RPMDEPLINT_EXPIRY_SECONDS', '604800'))
+
+
+def cache_size_budget():
+    """
+    Returns the maximum total size in bytes of the rpmdeplint cache, from the 
+    ``RPMDEPLINT_CACHE_SIZE`` environment variable, or None if it is unlimited.
+    """
+    value = os.environ.get('RPMDEPLINT_CACHE_SIZE')
+    if not value:
+        return None
+    return parse_size(value)
+
+
+# Maps the length of a hex digest to the hash algorithm which produces it, 
+# for verifying content-addressed cache entries.
+_HASH_ALGORITHMS_BY_HEX_LENGTH = {
+    32: 'md5',
+    40: 'sha1',
+    56: 'sha224',
+    64: 'sha256',
+    96: 'sha384',
+    128: 'sha512',
+}
+
+# Kinds of cache entries which are named after the checksum of their contents.
+CONTENT_ADDRESSED_CACHE_KINDS = ('repodata', 'package')
+
+
+class CacheIndex(object):
+    """
+    Index of the entries in the rpmdeplint cache, with their size and the time 
+    they were last used, so that the cache can be pruned without walking the 
+    whole cache directory. The index is an SQLite database, which makes it 
+    safe to share between concurrent rpmdeplint processes.
+
+    Each entry has a *kind*, which is one of:
+
+    * "repodata": a repodata file, named after its checksum
+    * "repomd": the most recently fetched repomd.xml of a repo
+    * "solv": a repo loaded in libsolv's solv format
+    * "fileindex": a memory-mapped index of the file paths in a repo
+    * "package": a downloaded package, named after its checksum
+    * "header": the header of a package, downloaded by itself
+    * "files": the file attributes of a package, for conflict checking
+    * "baseline": the pre-existing repoclosure problems in a set of repos
+    * "unknown": a file which was found in the cache directory but was not 
+      recorded by this version of rpmdeplint
+    """
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.path = os.path.join(base_path, 'index.sqlite')
+        self.pid = os.getpid()
+        try:
+            os.makedirs(base_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        is_new = not os.path.exists(self.path)
+        # Download threads record their entries too, access is serialized by 
+        # the lock below.
+        self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                    'path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                    'last_used REAL NOT NULL, kind TEXT NOT NULL)')
+        if is_new:
+            # Adopt whatever an older rpmdeplint left in the cache, so that it 
+            # is eventually expired too.
+            self.rescan()
+
+    def record(self, path, kind):
+        """
+        Records that the cache entry at *path* was just written or used.
+        """
+        try:
+            size = os.stat(path).st_size
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        relpath = os.path.relpath(path, self.base_path)
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO entries (path, size, last_used, kind) '
+                    'VALUES (?, ?, ?, ?)', (relpath, size, time.time(), kind))
+
+    def entries(self):
+        """
+        Returns a list of (path, size, last_used, kind) tuples for all entries, 
+        least recently used first.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT path, size, last_used, kind FROM entries '
+                    'ORDER BY last_used').fetchall()
+        return [(os.path.join(self.base_path, relpath), size, last_used, kind)
+                for relpath, size, last_used, kind in rows]
+
+    def remove(self, path, kind):
+        """
+        Deletes the cache entry at *path* and forgets about it.
+        """
+        logger.debug('Purging cache entry %s', path)
+        try:
+            if kind == 'repomd':
+                # The whole directory for the repo, including its validators
+                shutil.rmtree(os.path.dirname(os.path.dirname(path)))
+            else:
+                os.unlink(path)
+        except OSError as e:
+            # Another process may have removed it already
+            if e.errno != errno.ENOENT:
+                raise
+        relpath = os.path.relpath(path, self.base_path)
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM entries WHERE path = ?', (relpath,))
+
+    def rescan(self):
+        """
+        Reconciles the index with the contents of the cache directory: files 
+        which are not in the index are added, and entries for files which no 
+        longer exist are removed.
+        """
+        found = {}
+        for subdir in scandir(self.base_path):
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            if subdir.name == 'repomd':
+                for entry in scandir(subdir.path):
+                    path = os.path.join(entry.path, 'repodata', 'repomd.xml')
+                    try:
+                        st = os.stat(path)
+                    except OSError as e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                        continue
+                    found[os.path.relpath(path, self.base_path)] = (st, 'repomd')
+                continue
+            for path, st in self._files_in_subdir(subdir.path):
+                found[os.path.relpath(path, self.base_path)] = (st, 'unknown')
+        with self._lock, self._db:
+            known = set(row[0] for row in self._db.execute('SELECT path FROM entries'))
+            self._db.executemany('DELETE FROM entries WHERE path = ?',
+                    [(relpath,) for relpath in known.difference(found)])
+            self._db.executemany('INSERT INTO entries (path, size, last_used, kind) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(relpath, st.st_size, st.st_mtime, kind)
+                     for relpath, (st, kind) in found.items() if relpath not in known])
+
+    def _files_in_subdir(self, subdir_path):
+        """
+        Yields a tuple of (path, stat result) for each file in a subdirectory 
+        of the cache, which should be named after the first checksum letter.
+        """
+        for entry in scandir(subdir_path):
             if not entry.is_file(follow_symlinks=False):
                 continue
-            if entry.stat().st_mtime < expiry_time:
-                logger.debug('Purging expired cache file %s', entry.path)
-                os.unlink(entry.path)
+            try:
+                st = entry.stat()
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            yield entry.path, st
+
+    def remove_unrecorded(self, expiry_seconds):
+        """
+        Deletes the files in the cache which are not in the index and have not 
+        been modified for *expiry_seconds*, such as temporary files left 
+        behind by interrupted downloads. Recent ones are left alone, since 
+        another process may still be writing them. Returns the number of files 
+        deleted.
+        """
+        expiry_time = time.time() - expiry_seconds
+        with self._lock:
+            known = set(row[0] for row in self._db.execute('SELECT path FROM entries'))
+        removed = 0
+        for subdir in scandir(self.base_path):
+            if not subdir.is_dir(follow_symlinks=False) or subdir.name == 'repomd':
+                continue
+            for path, st in self._files_in_subdir(subdir.path):
+                if st.st_mtime >= expiry_time:
+                    continue
+                if os.path.relpath(path, self.base_path) in known:
+                    continue
+                logger.debug('Purging unrecorded cache file %s', path)
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    # Another process may have removed it already
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                removed += 1
+        return removed
+
+    def prune(self, expiry_seconds, size_budget=None):
+        """
+        Deletes entries which have not been used for *expiry_seconds*, then the 
+        least recently used entries until the total size is within 
+        *size_budget* bytes (if given). Returns the number of entries deleted.
+        """
+        expiry_time = time.time() - expiry_seconds
+        entries = self.entries()
+        total_size = sum(size for path, size, last_used, kind in entries)
+        removed = 0
+        for path, size, last_used, kind in entries:
+            if last_used >= expiry_time and (size_budget is None or total_size <= size_budget):
+                break
+            self.remove(path, kind)
+            total_size -= size
+            removed += 1
+        return removed
+
+    def verify(self):
+        """
+        Checks the contents of each content-addressed entry against its name, 
+        and deletes any which do not match. Returns a list of the paths which 
+        were deleted.
+        """
+        corrupted = []
+        for path, size, last_used, kind in self.entries():
+            if kind not in CONTENT_ADDRESSED_CACHE_KINDS:
+                continue
+            relpath = os.path.relpath(path, self.base_path)
+            checksum = relpath.replace(os.sep, '')
+            algorithm = _HASH_ALGORITHMS_BY_HEX_LENGTH.get(len(checksum))
+            if algorithm is None:
+                continue
+            h = hashlib.new(algorithm)
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(65536), b''):
+                        h.update(chunk)
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue # removed by a concurrent prune
+            if h.hexdigest() != checksum:
+                logger.warn('Cache entry %s is corrupted', path)
+                self.remove(path, kind)
+                corrupted.append(path)
+        return corrupted
+
+
+_cache_index = None
+_cache_index_lock = threading.Lock()
+_cache_pruned_at = None
+_cache_prune_lock = threading.Lock()
+
+
+def cache_index():
+    """
+    Returns the :py:class:`CacheIndex` for the rpmdeplint cache, opening it if 
+    necessary.
+    """
+    global _cache_index
+    with _cache_index_lock:
+        # SQLite connections cannot be carried across fork
+        if (_cache_index is None or _cache_index.base_path != cache_base_path()
+                or _cache_index.pid != os.getpid()):
+            _cache_index = CacheIndex(cache_base_path())
+        return _cache_index
+
+
+def record_cache_entry(path, kind):
+    """
+    Records the use of a cache entry in the index. Problems with the index are 
+    not fatal, they just mean the entry might be evicted sooner or later than 
+    it should be.
+    """
+    try:
+        cache_index().record(path, kind)
+    except (sqlite3.Error, OSError) as e:
+        logger.warn('Cannot update cache index for %s: %s', path, e)
+
+
+def write_cache_file(path, kind, content):
+    """
+    Writes a cache file atomically, so that concurrent runs never see
+    a partially written cache entry, and records it in the cache index as
+    *kind*. If *kind* is None the file is part of another cache entry, and is
+    not recorded on its own.
+
+    *content* is either the bytes to write, or a function which is called
+    with an open file descriptor and returns True if it wrote the file
+    successfully. Returns True if the file was written. Errors are raised,
+    after removing the temporary file.
+    """
+    if isinstance(content, bytes):
+        data = content
+        def content(fd):
+            with os.fdopen(os.dup(fd), 'wb') as f:
+                f.write(data)
+            return True
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        try:
+            written = content(fd)
+            if written:
+                os.fchmod(fd, 0o644)
+                os.rename(temp_path, path)
+        finally:
+            os.close(fd)
+    except:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    if not written:
+        os.unlink(temp_path)
+        return False
+    if kind is not None:
+        record_cache_entry(path, kind)
+    return True
+
+
+def clean_cache():
+    """
+    Prunes expired entries from the cache, and the least recently used entries 
+    if the cache is over its size budget. Expired files which are not in the 
+    cache index at all are deleted too. This is done at most once an hour, so 
+    once per run of a command, and regularly in a long-running server.
+    """
+    global _cache_pruned_at
+    with _cache_prune_lock:
+        now = time.time()
+        if _cache_pruned_at is not None and now - _cache_pruned_at < 3600:
+            return
+        _cache_pruned_at = now
+        try:
+            index = cache_index()
+            index.prune(cache_expiry_seconds(), cache_size_budget())
+            index.remove_unrecorded(cache_expiry_seconds())
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.warn('Cannot prune cache: %s', e)
 
 
 class Repo(object):
@@ -137,20 +608,29 @@ class Repo(object):
             skip_if_unavailable = False
             if config.has_option(section, 'skip_if_unavailable'):
                 skip_if_unavailable = config.getboolean(section, 'skip_if_unavailable')
+            metadata_expire = 0
+            if config.has_option(section, 'metadata_expire'):
+                metadata_expire = parse_metadata_expire(config.get(section, 'metadata_expire'))
+            elif config.has_option('main', 'metadata_expire'):
+                metadata_expire = parse_metadata_expire(config.get('main', 'metadata_expire'))
             if config.has_option(section, 'baseurl'):
                 baseurl = substitute_yumvars(config.get(section, 'baseurl'), yumvars)
-                yield cls(section, baseurl=baseurl, skip_if_unavailable=skip_if_unavailable)
+                yield cls(section, baseurl=baseurl, skip_if_unavailable=skip_if_unavailable,
+                        metadata_expire=metadata_expire)
             elif config.has_option(section, 'metalink'):
                 metalink = substitute_yumvars(config.get(section, 'metalink'), yumvars)
-                yield cls(section, metalink=metalink, skip_if_unavailable=skip_if_unavailable)
+                yield cls(section, metalink=metalink, skip_if_unavailable=skip_if_unavailable,
+                        metadata_expire=metadata_expire)
             elif config.has_option(section, 'mirrorlist'):
                 mirrorlist = substitute_yumvars(config.get(section, 'mirrorlist'), yumvars)
-                yield cls(section, metalink=mirrorlist, skip_if_unavailable=skip_if_unavailable)
+                yield cls(section, metalink=mirrorlist, skip_if_unavailable=skip_if_unavailable,
+                        metadata_expire=metadata_expire)
             else:
                 raise ValueError('Yum config section %s has no '
                         'baseurl or metalink or mirrorlist' % section)
 
-    def __init__(self, repo_name, baseurl=None, metalink=None, skip_if_unavailable=False):
+    def __init__(self, repo_name, baseurl=None, metalink=None, skip_if_unavailable=False,
+            metadata_expire=0):
         """
         :param repo_name: Name of the repository, for example "fedora-updates"
                           (used in problems and error messages)
@@ -160,6 +640,9 @@ class Repo(object):
                          the repository can be found
         :param skip_if_unavailable: If True, suppress errors downloading
                                     repodata from the repository
+        :param metadata_expire: Number of seconds for which a previously 
+                                downloaded repomd.xml is used without 
+                                checking the repository for changes
 
         Exactly one of the *baseurl* or *metalink* parameters must be supplied.
         """
@@ -169,11 +652,21 @@ class Repo(object):
         self.baseurl = baseurl
         self.metalink = metalink
         self.skip_if_unavailable = skip_if_unavailable
+        self.metadata_expire = metadata_expire
+        self._temp_dir = None
+        self._filelists = None
 
     def download_repodata(self):
+        """
+        Downloads repomd.xml and primary.xml for the repo. The much larger 
+        filelists.xml is only downloaded when :py:attr:`filelists` is first 
+        accessed.
+        """
         clean_cache()
+        self._filelists = None
         logger.debug('Loading repodata for %s from %s', self.name,
             self.baseurl or self.metalink)
+        import librepo
         self.librepo_handle = h = librepo.Handle()
         r = librepo.Result()
         h.repotype = librepo.LR_YUMREPO
@@ -181,27 +674,99 @@ class Repo(object):
             h.urls = [self.baseurl]
         if self.metalink:
             h.mirrorlist = self.metalink
-        h.setopt(librepo.LRO_DESTDIR, tempfile.mkdtemp(self.name,
-           prefix=REPO_CACHE_NAME_PREFIX, dir=REPO_CACHE_DIR))
         h.setopt(librepo.LRO_INTERRUPTIBLE, True)
         h.setopt(librepo.LRO_YUMDLIST, [])
         if self.baseurl and os.path.isdir(self.baseurl):
+            h.local = True
             self._download_metadata_result(h, r)
             self._yum_repomd = r.yum_repomd
             self._root_path = self.baseurl
             self.primary = open(self.primary_url, 'rb')
-            self.filelists = open(self.filelists_url, 'rb')
+        elif self.baseurl:
+            # The librepo handle is only used for package downloads here. We 
+            # fetch repomd.xml ourselves, so that we can skip the request 
+            # entirely while it is fresh, or make it conditional otherwise.
+            self._root_path = repomd_cache_path(self.baseurl)
+            self._fetch_repomd()
+            self._yum_repomd = self._load_repomd(self._root_path)
+            self.primary = self._download_repodata_file(
+                self.primary_checksum, self.primary_url)
         else:
-            self._root_path = h.destdir = tempfile.mkdtemp(self.name,
+            self._root_path = self._temp_dir = h.destdir = tempfile.mkdtemp(self.name,
                 prefix=REPO_CACHE_NAME_PREFIX, dir=REPO_CACHE_DIR)
             self._download_metadata_result(h, r)
             self._yum_repomd = r.yum_repomd
             self.primary = self._download_repodata_file(
                 self.primary_checksum, self.primary_url)
-            self.filelists = self._download_repodata_file(
-                self.filelists_checksum, self.filelists_url)
+
+    def _fetch_repomd(self):
+        """
+        Makes sure the cached copy of repomd.xml under :py:attr:`repomd_fn` is 
+        up to date. While it is younger than *metadata_expire* the repo is not 
+        contacted at all. After that, the request is conditional on the ETag 
+        and Last-Modified validators we saw last time, so an unchanged 
+        repomd.xml is not downloaded again.
+        """
+        validators_path = os.path.join(self._root_path, 'validators.json')
+        try:
+            age = time.time() - os.path.getmtime(self.repomd_fn)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            validators = {}
+        else:
+            if age < self.metadata_expire:
+                logger.debug('Using cached %s for %s without checking for changes',
+                        self.repomd_fn, self.name)
+                record_cache_entry(self.repomd_fn, 'repomd')
+                return
+            try:
+                with open(validators_path) as f:
+                    validators = json.load(f)
+            except (IOError, ValueError):
+                validators = {}
+        # Last-Modified only has one second resolution, so prefer the ETag if 
+        # the server gave us one.
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        elif validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        url = os.path.join(self.baseurl, 'repodata', 'repomd.xml')
+        logger.debug('Downloading %s', url)
+        try:
+            response = requests_session().get(url, headers=headers)
+            if response.status_code == 304:
+                logger.debug('Cached %s for %s is still current', self.repomd_fn, self.name)
+                os.utime(self.repomd_fn, None)
+                record_cache_entry(self.repomd_fn, 'repomd')
+                return
+            response.raise_for_status()
+        except IOError as e:
+            raise RepoDownloadError('Failed to download repodata for %r: '
+                    'Cannot download repomd.xml: %s' % (self, e))
+        # repomd.xml must be replaced before the validators, otherwise an 
+        # interruption could leave us with new validators for an old file.
+        # The validators belong to the repomd entry, and are pruned with it.
+        write_cache_file(self.repomd_fn, 'repomd', response.content)
+        write_cache_file(validators_path, None, json.dumps({
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }).encode('utf8'))
+
+    def _load_repomd(self, path):
+        import librepo
+        h = librepo.Handle()
+        r = librepo.Result()
+        h.repotype = librepo.LR_YUMREPO
+        h.urls = [path]
+        h.local = True
+        h.setopt(librepo.LRO_YUMDLIST, [])
+        self._download_metadata_result(h, r)
+        return r.yum_repomd
 
     def _download_metadata_result(self, handle, result):
+        import librepo
         try:
             handle.perform(result)
         except librepo.LibrepoException as ex:
@@ -240,6 +805,7 @@ class Repo(object):
                 os.utime(f.fileno()) # Python 3.3+
             else:
                 os.utime(filepath_in_cache, None)
+            record_cache_entry(filepath_in_cache, 'repodata')
             return f
         try:
             os.makedirs(os.path.dirname(filepath_in_cache))
@@ -255,7 +821,7 @@ class Repo(object):
             raise
         try:
             try:
-                response = requests_session.get(url, stream=True)
+                response = requests_session().get(url, stream=True)
                 response.raise_for_status()
                 for chunk in response.raw.stream(decode_content=False):
                     f.write(chunk)
@@ -267,6 +833,7 @@ class Repo(object):
             f.seek(0)
             os.fchmod(f.fileno(), 0o644)
             os.rename(temp_path, filepath_in_cache)
+            record_cache_entry(filepath_in_cache, 'repodata')
             logger.debug('Using cached file %s for %s', filepath_in_cache, url)
             return f
         except:
@@ -275,26 +842,173 @@ class Repo(object):
             raise
 
     def download_package(self, location, baseurl, checksum_type, checksum):
+        """
+        Returns a local path to the given package. Packages from remote repos 
+        are stored in the cache, named after their checksum, so they are 
+        shared between runs and between repos (or mirrors) containing the same 
+        package.
+        """
         if self.librepo_handle.local:
             local_path = os.path.join(self._root_path, location)
             logger.debug('Using package %s from local filesystem directly', local_path)
             return local_path
-        logger.debug('Loading package %s from repo %s', location, self.name)
+        filepath_in_cache = cache_entry_path(checksum)
+        if os.path.isfile(filepath_in_cache):
+            logger.debug('Using cached package %s for %s', filepath_in_cache, location)
+            # Bump the modtime, for consistency with the repodata files
+            os.utime(filepath_in_cache, None)
+            record_cache_entry(filepath_in_cache, 'package')
+            return filepath_in_cache
+        try:
+            os.makedirs(os.path.dirname(filepath_in_cache))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Like the repodata files, the package is downloaded to a temp file 
+        # and renamed into place once librepo has verified its checksum.
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath_in_cache))
+        os.close(fd)
+        logger.debug('Loading package %s from repo %s to cache temp file %s',
+                location, self.name, temp_path)
+        # The handle has not fetched any metadata itself for baseurl repos, so 
+        # give librepo the base URL explicitly unless xml:base overrides it.
+        import librepo
         target = librepo.PackageTarget(location,
-                base_url=baseurl,
+                base_url=baseurl or self.baseurl,
                 checksum_type=librepo.checksum_str_to_type(checksum_type),
                 checksum=checksum,
-                dest=self._root_path,
+                dest=temp_path,
+                resume=False,
                 handle=self.librepo_handle)
-        librepo.download_packages([target])
-        if target.err and target.err == 'Already downloaded':
-            logger.debug('Already downloaded %s', target.local_path)
-        elif target.err:
+        try:
+            librepo.download_packages([target])
+            if target.err and target.err != 'Already downloaded':
+                raise PackageDownloadError('Failed to download %s from repo %s: %s'
+                        % (location, self.name, target.err))
+            os.chmod(temp_path, 0o644)
+            os.rename(temp_path, filepath_in_cache)
+        except:
+            os.unlink(temp_path)
+            raise
+        logger.debug('Saved as %s', filepath_in_cache)
+        record_cache_entry(filepath_in_cache, 'package')
+        return filepath_in_cache
+
+    #: Number of bytes to request initially when fetching a package header 
+    #: whose size is not known in advance
+    header_fetch_size = 64 * 1024
+
+    #: Suffix of the cached files containing just the header of a package
+    header_suffix = '.hdr'
+
+    def download_package_header(self, location, baseurl, checksum_type, checksum,
+            header_end=None):
+        """
+        Returns a local path to a file containing just the lead, signature and 
+        header of the given package (which is all rpm needs to read the 
+        header). The header is fetched with ranged requests, reading the 
+        first *header_end* bytes if the header range is known from 
+        primary.xml. Headers are stored in the cache alongside the packages, 
+        with a name ending in :py:attr:`header_suffix`.
+
+        If the server does not support ranged requests, or the repo is not 
+        reachable over HTTP, the whole package is downloaded (and cached) 
+        instead, and its path is returned.
+        """
+        if self.librepo_handle.local:
+            return self.download_package(location, baseurl, checksum_type, checksum)
+        package_path_in_cache = cache_entry_path(checksum)
+        if os.path.isfile(package_path_in_cache):
+            return self.download_package(location, baseurl, checksum_type, checksum)
+        url = os.path.join(baseurl or self.baseurl or '', location)
+        if not url.startswith(('http://', 'https://')):
+            # Mirrors are left to librepo
+            return self.download_package(location, baseurl, checksum_type, checksum)
+        filepath_in_cache = package_path_in_cache + self.header_suffix
+        if os.path.isfile(filepath_in_cache):
+            logger.debug('Using cached header %s for %s', filepath_in_cache, location)
+            os.utime(filepath_in_cache, None)
+            record_cache_entry(filepath_in_cache, 'header')
+            return filepath_in_cache
+        try:
+            os.makedirs(os.path.dirname(filepath_in_cache))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        data = b''
+        length = header_end
+        while length is None or len(data) < length:
+            end = length if length is not None else len(data) + self.header_fetch_size
+            logger.debug('Downloading bytes %d-%d of %s', len(data), end - 1, url)
+            try:
+                response = requests_session().get(url, stream=True,
+                        headers={'Range': 'bytes=%d-%d' % (len(data), end - 1)})
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # Range was ignored, so take the whole package instead
+                    logger.debug('Server ignored Range request for %s', url)
+                    return self._save_package_response(response, location,
+                            checksum_type, checksum)
+                chunk = response.content
+            except IOError as e:
+                raise PackageDownloadError('Failed to download %s from repo %s: %s'
+                        % (location, self.name, e))
+            if not chunk:
+                raise PackageDownloadError('Failed to download %s from repo %s: '
+                        'package is truncated' % (location, self.name))
+            data += chunk
+            if header_end is None:
+                try:
+                    length = rpm_header_length(data)
+                except ValueError as e:
+                    raise PackageDownloadError('Failed to download %s from repo %s: %s'
+                            % (location, self.name, e))
+        data = data[:length]
+        write_cache_file(filepath_in_cache, 'header', data)
+        logger.debug('Saved header of %s as %s', location, filepath_in_cache)
+        return filepath_in_cache
+
+    def _save_package_response(self, response, location, checksum_type, checksum):
+        """
+        Streams a complete package from the given response into the cache, 
+        verifying its checksum.
+        """
+        filepath_in_cache = cache_entry_path(checksum)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath_in_cache))
+        try:
+            h = hashlib.new(checksum_type)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(65536):
+                    h.update(chunk)
+                    f.write(chunk)
+                os.fchmod(f.fileno(), 0o644)
+            if h.hexdigest() != checksum:
+                raise PackageDownloadError('Failed to download %s from repo %s: '
+                        'checksum mismatch' % (location, self.name))
+            os.rename(temp_path, filepath_in_cache)
+        except IOError as e:
+            os.unlink(temp_path)
             raise PackageDownloadError('Failed to download %s from repo %s: %s'
-                    % (location, self.name, target.err))
-        else:
-            logger.debug('Saved as %s', target.local_path)
-        return target.local_path
+                    % (location, self.name, e))
+        except:
+            os.unlink(temp_path)
+            raise
+        logger.debug('Saved as %s', filepath_in_cache)
+        record_cache_entry(filepath_in_cache, 'package')
+        return filepath_in_cache
+
+    def close(self):
+        """
+        Closes the repodata files and removes any temporary directory created 
+        for downloading repodata.
+        """
+        if getattr(self, 'primary', None) is not None:
+            self.primary.close()
+        if self._filelists is not None:
+            self._filelists.close()
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
 
     @property
     def yum_repomd(self):
@@ -312,6 +1026,18 @@ class Repo(object):
     def filelists_checksum(self):
         return self.yum_repomd['filelists']['checksum']
     @property
+    def filelists(self):
+        """
+        File object for filelists.xml, which is downloaded on first access.
+        """
+        if self._filelists is None:
+            if self.librepo_handle.local:
+                self._filelists = open(self.filelists_url, 'rb')
+            else:
+                self._filelists = self._download_repodata_file(
+                    self.filelists_checksum, self.filelists_url)
+        return self._filelists
+    @property
     def filelists_url(self):
         return os.path.join(self.baseurl, self.yum_repomd['filelists']['location_href'])
 
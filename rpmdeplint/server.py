@@ -0,0 +1,209 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""
+Server for ``rpmdeplint serve``, which keeps the repos loaded between
+requests so that each check only costs as much as the checking itself.
+
+Requests and responses are single lines of JSON on a Unix socket. A request
+is an object with these keys:
+
+``rpms``
+    List of paths to the RPM packages to be checked (required). The paths
+    are opened by the server, so they must be absolute or relative to its
+    working directory.
+``repos``
+    List of ``NAME,URL`` repos to check against, as for :option:`--repo`.
+    The default is the repos given when the server was started.
+``arch``
+    Arch to check against. The default is the :option:`--arch` given when
+    the server was started.
+``checks``
+    List of the checks to perform, named after their commands. The default
+    is every check performed by ``rpmdeplint check``.
+``full_repoclosure``, ``repoclosure_engine``, ``upgrade_engine``, ``jobs``
+    Options for the checks, as for the corresponding command line options.
+    The defaults are those given when the server was started.
+
+The response is an object with a ``status``, which is the exit status the
+equivalent command would have: 0 if no problems were found, 3 if problems
+were found, or 1 if the checks could not be performed. Its ``problems`` are
+an object with a list of str problems for each check performed. If the
+status is 1, ``error`` describes what went wrong instead.
+
+Requests are handled one at a time, because a libsolv pool cannot be used by
+more than one thread at once. So that a client which stops sending requests
+cannot hold up the others, a connection is closed once it has been idle for
+longer than the connection timeout. The socket can only be connected to by
+the user running the server.
+"""
+
+from __future__ import absolute_import
+
+import os
+import stat
+import socket
+import argparse
+import copy
+import json
+import time
+import logging
+from collections import OrderedDict
+from six.moves import socketserver
+from rpmdeplint import RepoSet
+from rpmdeplint.repodata import RepoDownloadError
+from rpmdeplint.cli import all_checks, repos_from_args, comma_separated_repo
+from rpmdeplint.batch import check_package_set
+
+logger = logging.getLogger(__name__)
+
+
+class _CheckRequestHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        self.timeout = self.server.connection_timeout
+        socketserver.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        try:
+            self._handle_requests()
+        except socket.timeout:
+            logger.debug('Closing connection idle for more than %s seconds',
+                    self.timeout)
+
+    def _handle_requests(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode('utf8'))
+                if not isinstance(request, dict):
+                    raise ValueError('request is not an object')
+            except ValueError as e:
+                response = {'status': 1, 'error': u'Invalid request: %s' % e}
+            else:
+                response = self.server.handle_check(request)
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+
+class CheckServer(socketserver.UnixStreamServer):
+    """
+    Server which performs checks for requests on a Unix socket, keeping a
+    :py:class:`rpmdeplint.RepoSet` loaded for each set of repos it has been
+    asked about.
+
+    :param socket_path: Path of the Unix socket to listen on. A stale socket
+                        left there by a previous server is replaced.
+    :param defaults: :py:class:`argparse.Namespace` of the command line
+                     options, which supply the default repos, arch and
+                     check options for requests
+    :param max_repo_sets: Maximum number of sets of repos to keep loaded.
+                          The least recently used is closed to make room.
+    :param reload_after: Number of seconds after which a set of repos is
+                         loaded again, to pick up changes to the repos
+    :param connection_timeout: Number of seconds a client may take to send
+                               a request or read a response before its
+                               connection is closed
+    """
+
+    def __init__(self, socket_path, defaults, max_repo_sets=4, reload_after=3600,
+            connection_timeout=60):
+        try:
+            if stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                os.unlink(socket_path)
+        except OSError:
+            pass
+        socketserver.UnixStreamServer.__init__(self, socket_path, _CheckRequestHandler)
+        self.socket_path = socket_path
+        self.defaults = defaults
+        self.max_repo_sets = max_repo_sets
+        self.reload_after = reload_after
+        self.connection_timeout = connection_timeout
+        #: Mapping of {(repos, arch): (time loaded, repo set)}, least
+        #: recently used first
+        self._repo_sets = OrderedDict()
+
+    def server_bind(self):
+        # The socket is created with the permissions allowed by the umask, so 
+        # restrict them before binding rather than after, when another user 
+        # could already have connected.
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(old_umask)
+
+    def _repo_set(self, repo_specs, arch):
+        """
+        Returns the repo set for the given repos (None meaning the default
+        repos) and arch, loading the repos if they are not loaded yet.
+        """
+        key = (tuple(repo_specs) if repo_specs is not None else None, arch)
+        loaded, repo_set = self._repo_sets.pop(key, (None, None))
+        if repo_set is not None and time.time() - loaded > self.reload_after:
+            logger.debug('Reloading repos %r for arch %s', key[0], arch)
+            repo_set.close()
+            repo_set = None
+        if repo_set is None:
+            if repo_specs is None:
+                repos = repos_from_args(self.defaults)
+            else:
+                repos = [comma_separated_repo(spec) for spec in repo_specs]
+                if self.defaults.metadata_expire is not None:
+                    for repo in repos:
+                        repo.metadata_expire = self.defaults.metadata_expire
+            if not repos:
+                raise ValueError('no repos specified to test against')
+            repo_set = RepoSet(repos, arch=arch,
+                    max_parallel_downloads=self.defaults.max_parallel_downloads)
+            loaded = time.time()
+        self._repo_sets[key] = (loaded, repo_set)
+        while len(self._repo_sets) > self.max_repo_sets:
+            _, (_, evicted) = self._repo_sets.popitem(last=False)
+            evicted.close()
+        return repo_set
+
+    def handle_check(self, request):
+        """
+        Performs the checks for a request, and returns the response.
+        """
+        try:
+            rpms = list(request['rpms'])
+            checks = request.get('checks', all_checks)
+            unknown = [check for check in checks if check not in all_checks]
+            if unknown:
+                raise ValueError('unknown checks %s' % ', '.join(unknown))
+            args = copy.copy(self.defaults)
+            for option in ['full_repoclosure', 'repoclosure_engine',
+                    'upgrade_engine', 'jobs']:
+                if option in request:
+                    setattr(args, option, request[option])
+        except KeyError as e:
+            return {'status': 1, 'error': u'Invalid request: missing %s' % e}
+        except (TypeError, ValueError) as e:
+            return {'status': 1, 'error': u'Invalid request: %s' % e}
+        try:
+            repo_set = self._repo_set(request.get('repos'),
+                    request.get('arch', self.defaults.arch))
+        except (RepoDownloadError, argparse.ArgumentTypeError, ValueError) as e:
+            return {'status': 1, 'error': u'%s' % e}
+        except Exception as e:
+            logger.exception('Failed to load repos for %r', request)
+            return {'status': 1, 'error': u'%s' % e}
+        return check_package_set(repo_set, rpms, checks, args)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for _, repo_set in self._repo_sets.values():
+            repo_set.close()
+        self._repo_sets.clear()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
@@ -0,0 +1,20 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import sys
+import subprocess
+
+
+def test_slow_modules_are_not_imported_at_startup():
+    # These take most of the startup time, so they must only be imported once 
+    # a command needs them. Otherwise even --help becomes slow.
+    slow_modules = ['pkg_resources', 'requests', 'librepo', 'solv', 'rpm',
+            'ctypes', 'dnf', 'yum']
+    code = ('import sys, rpmdeplint.cli, rpmdeplint.repodata, rpmdeplint.server, '
+            'rpmdeplint.batch; '
+            'sys.stdout.write(" ".join(sorted(name for name in %r '
+            'if name in sys.modules)))' % slow_modules)
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode('ascii') == ''
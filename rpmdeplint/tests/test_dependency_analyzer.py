@@ -5,13 +5,26 @@
 # (at your option) any later version.
 
 import shutil
+import tempfile
 from unittest import TestCase
-from rpmdeplint import DependencyAnalyzer
-from rpmdeplint.repodata import Repo
+from rpmdeplint import DependencyAnalyzer, RepoSet, _solv_cache_checksum
+from rpmdeplint.repodata import Repo, cache_entry_path
 import os
 import rpmfluff
 
 class TestDependencyAnalyzer(TestCase):
+
+    def setUp(self):
+        # Each test starts with an empty rpmdeplint cache of its own
+        cache_home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_home)
+        old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = cache_home
+        if old_cache_home is None:
+            self.addCleanup(os.environ.pop, 'XDG_CACHE_HOME')
+        else:
+            self.addCleanup(os.environ.__setitem__, 'XDG_CACHE_HOME', old_cache_home)
+
     def test_repos(self):
         lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
         lemon.add_provides('lemon-juice')
@@ -76,3 +89,521 @@ class TestDependencyAnalyzer(TestCase):
         self.assertEqual(True, ok)
         self.assertEqual(4, len(dependency_set.package_dependencies['lemon-meringue-pie-1-0.x86_64']['dependencies']))
         self.assertEqual(3, len(dependency_set.package_dependencies['apple-4.9-3.x86_64']['dependencies']))
+
+    def test_repo_is_loaded_from_solv_cache(self):
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_provides('lemon-juice')
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('lemon-juice')
+        lemonade.make()
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+
+        repo = Repo(repo_name='base', baseurl=base_repo.repoDir)
+        da = DependencyAnalyzer(repos=[repo],
+                packages=[lemonade.get_built_rpm('noarch')])
+        ok, dependency_set = da.try_to_install_all()
+        self.assertEqual(True, ok)
+
+        cache_path = cache_entry_path(_solv_cache_checksum(
+                'primary', repo.primary_checksum))
+        self.assertTrue(os.path.isfile(cache_path))
+        os.utime(cache_path, (0, 0))
+
+        da = DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[lemonade.get_built_rpm('noarch')])
+        ok, dependency_set = da.try_to_install_all()
+        self.assertEqual(True, ok)
+        self.assertEqual(['lemon-1-3.noarch'],
+                dependency_set.package_dependencies['lemonade-1-0.noarch']['dependencies'])
+        # The cache entry was used, so its modtime has been bumped
+        self.assertNotEqual(0, os.path.getmtime(cache_path))
+
+    def test_skips_unavailable_repo_when_downloading_in_parallel(self):
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_provides('lemon-juice')
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_1_repo = rpmfluff.YumRepoBuild([lemon])
+        base_1_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_1_repo.repoDir)
+        sugar = rpmfluff.SimpleRpmBuild('sugar', '4', '0', ['noarch'])
+        self.addCleanup(shutil.rmtree, sugar.get_base_dir())
+        base_2_repo = rpmfluff.YumRepoBuild([sugar])
+        base_2_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_2_repo.repoDir)
+
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('lemon-juice')
+        lemonade.add_requires('sugar')
+        lemonade.make()
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+
+        da = DependencyAnalyzer(
+                repos=[Repo(repo_name='base_1', baseurl=base_1_repo.repoDir),
+                       Repo(repo_name='broken', baseurl='http://example.invalid/',
+                            skip_if_unavailable=True),
+                       Repo(repo_name='base_2', baseurl=base_2_repo.repoDir)],
+                packages=[lemonade.get_built_rpm('noarch')],
+                max_parallel_downloads=3)
+        self.assertEqual(['base_1', 'base_2'], sorted(da.repos_by_name))
+        ok, dependency_set = da.try_to_install_all()
+        self.assertEqual(True, ok)
+        self.assertEqual(['lemon-1-3.noarch', 'sugar-4-0.noarch'],
+                sorted(dependency_set.package_dependencies['lemonade-1-0.noarch']['dependencies']))
+
+    def test_loads_filelists_for_file_requirement_missing_from_primary(self):
+        # Primary only lists files in bin directories and /etc, so this 
+        # requirement can only be satisfied once filelists is loaded.
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_installed_file(installPath='usr/share/lemon/zest',
+                sourceFile=rpmfluff.SourceFile('zest', 'zesty\n'))
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('/usr/share/lemon/zest')
+        lemonade.make()
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+
+        da = DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[lemonade.get_built_rpm('noarch')])
+        ok, dependency_set = da.try_to_install_all()
+        self.assertEqual(True, ok)
+        self.assertEqual(['lemon-1-3.noarch'],
+                dependency_set.package_dependencies['lemonade-1-0.noarch']['dependencies'])
+
+    def test_repoclosure_loads_filelists_for_repo_file_requirements(self):
+        # Only the repos require a file missing from primary, so the 
+        # packages under test do not cause the file lists to be loaded.
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_installed_file(installPath='usr/share/lemon/zest',
+                sourceFile=rpmfluff.SourceFile('zest', 'zesty\n'))
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('/usr/share/lemon/zest')
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon, lemonade])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        zestless_lemon = rpmfluff.SimpleRpmBuild('lemon', '2', '0', ['noarch'])
+        zestless_lemon.make()
+        self.addCleanup(shutil.rmtree, zestless_lemon.get_base_dir())
+
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[zestless_lemon.get_built_rpm('noarch')]) as da:
+            self.assertEqual(['package lemonade-1-0.noarch requires '
+                    '/usr/share/lemon/zest, but none of the providers can be installed'],
+                    da.find_repoclosure_problems())
+
+    def test_parses_each_header_once_when_finding_conflicts(self):
+        packages = []
+        for name, content in [('lemonade', 'sweet\n'), ('limeade', 'sour\n')]:
+            p = rpmfluff.SimpleRpmBuild(name, '1', '0', ['noarch'])
+            for filename in ['cup', 'glass', 'jug']:
+                p.add_installed_file(installPath='usr/share/drinks/' + filename,
+                        sourceFile=rpmfluff.SourceFile(filename, content))
+            p.make()
+            self.addCleanup(shutil.rmtree, p.get_base_dir())
+            packages.append(p.get_built_rpm('noarch'))
+
+        da = DependencyAnalyzer(repos=[], packages=packages)
+        conflicts = da.find_conflicts()
+        self.assertEqual(6, len(conflicts))
+        self.assertEqual(2, da.header_cache.misses)
+
+    def test_file_index_is_cached_for_conflict_checks(self):
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_installed_file(installPath='usr/share/fruit/zest',
+                sourceFile=rpmfluff.SourceFile('zest', 'lemony\n'))
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        lime = rpmfluff.SimpleRpmBuild('lime', '1', '0', ['noarch'])
+        lime.add_installed_file(installPath='usr/share/fruit/zest',
+                sourceFile=rpmfluff.SourceFile('zest', 'limey\n'))
+        lime.make()
+        self.addCleanup(shutil.rmtree, lime.get_base_dir())
+
+        repo = Repo(repo_name='base', baseurl=base_repo.repoDir)
+        with DependencyAnalyzer(repos=[repo],
+                packages=[lime.get_built_rpm('noarch')]) as da:
+            self.assertEqual(1, len(da.find_conflicts()))
+
+        cache_path = cache_entry_path(_solv_cache_checksum(
+                'fileindex', repo.primary_checksum, repo.filelists_checksum))
+        self.assertTrue(os.path.isfile(cache_path))
+        os.utime(cache_path, (0, 0))
+
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[lime.get_built_rpm('noarch')]) as da:
+            conflicts = da.find_conflicts()
+        self.assertEqual([u'lime-1-0.noarch provides /usr/share/fruit/zest '
+                'which is also provided by lemon-1-3.noarch'], conflicts)
+        # The cache entry was used, so its modtime has been bumped
+        self.assertNotEqual(0, os.path.getmtime(cache_path))
+
+    def test_reuses_install_results_between_checks(self):
+        packages = []
+        for name, content in [('lemonade', 'sweet\n'), ('limeade', 'sour\n')]:
+            p = rpmfluff.SimpleRpmBuild(name, '1', '0', ['noarch'])
+            p.add_installed_file(installPath='usr/share/drinks/cup',
+                    sourceFile=rpmfluff.SourceFile('cup', content))
+            p.make()
+            self.addCleanup(shutil.rmtree, p.get_base_dir())
+            packages.append(p.get_built_rpm('noarch'))
+
+        da = DependencyAnalyzer(repos=[], packages=packages)
+        self.assertEqual(2, len(da.find_conflicts()))
+        # Each package is solved on its own once, for the first pair
+        self.assertEqual(2, da.solves_saved)
+        ok, dependency_set = da.try_to_install_all()
+        self.assertEqual(True, ok)
+        self.assertEqual(4, da.solves_saved)
+
+    def test_targeted_repoclosure_finds_same_problems_as_full(self):
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, libfoo4.get_base_dir())
+        oldname = rpmfluff.SimpleRpmBuild('oldname', '1', '0', ['noarch'])
+        oldname.add_provides('oldname-api')
+        self.addCleanup(shutil.rmtree, oldname.get_base_dir())
+        direct = rpmfluff.SimpleRpmBuild('direct', '1', '0', ['noarch'])
+        direct.add_requires('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, direct.get_base_dir())
+        indirect = rpmfluff.SimpleRpmBuild('indirect', '1', '0', ['noarch'])
+        indirect.add_requires('direct')
+        self.addCleanup(shutil.rmtree, indirect.get_base_dir())
+        api_user = rpmfluff.SimpleRpmBuild('api-user', '1', '0', ['noarch'])
+        api_user.add_requires('oldname-api')
+        self.addCleanup(shutil.rmtree, api_user.get_base_dir())
+        broken = rpmfluff.SimpleRpmBuild('broken', '1', '0', ['noarch'])
+        broken.add_requires('doesnotexist')
+        self.addCleanup(shutil.rmtree, broken.get_base_dir())
+        unrelated = rpmfluff.SimpleRpmBuild('unrelated', '1', '0', ['noarch'])
+        unrelated.add_requires('libfoo')
+        self.addCleanup(shutil.rmtree, unrelated.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([libfoo4, oldname, direct, indirect,
+                api_user, broken, unrelated])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+        newname = rpmfluff.SimpleRpmBuild('newname', '1', '0', ['noarch'])
+        newname.add_obsoletes('oldname < 2')
+        newname.make()
+        self.addCleanup(shutil.rmtree, newname.get_base_dir())
+
+        da = DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[libfoo5.get_built_rpm('noarch'),
+                          newname.get_built_rpm('noarch')])
+        targeted = da.find_repoclosure_problems()
+        full = da.find_repoclosure_problems(full=True)
+        self.assertEqual(full, targeted)
+        self.assertEqual([
+                'package api-user-1-0.noarch requires oldname-api, '
+                    'but none of the providers can be installed',
+                'package direct-1-0.noarch requires libfoo.so.4, '
+                    'but none of the providers can be installed',
+                'package indirect-1-0.noarch requires direct, '
+                    'but none of the providers can be installed',
+                ], sorted(targeted))
+
+    def test_repoclosure_baseline_is_cached(self):
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, libfoo4.get_base_dir())
+        broken = rpmfluff.SimpleRpmBuild('broken', '1', '0', ['noarch'])
+        broken.add_requires('libfoo.so.4')
+        broken.add_requires('doesnotexist')
+        self.addCleanup(shutil.rmtree, broken.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([libfoo4, broken])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+        libfoo51 = rpmfluff.SimpleRpmBuild('libfoo', '5.1', '1', ['noarch'])
+        libfoo51.add_provides('libfoo.so.5')
+        libfoo51.make()
+        self.addCleanup(shutil.rmtree, libfoo51.get_base_dir())
+
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[libfoo5.get_built_rpm('noarch')]) as da:
+            self.assertEqual([], da.find_repoclosure_problems())
+            self.assertEqual(0, da.solves_saved)
+            baseline_path = da._repoclosure_baseline_path()
+        self.assertTrue(os.path.isfile(baseline_path))
+
+        # The baseline does not depend on the packages under test
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[libfoo51.get_built_rpm('noarch')]) as da:
+            self.assertEqual([], da.find_repoclosure_problems())
+            # The pre-existing problem came from the baseline
+            self.assertEqual(1, da.solves_saved)
+
+    def test_repoclosure_problem_is_new_if_packages_under_test_are_needed(self):
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, libfoo4.get_base_dir())
+        broken = rpmfluff.SimpleRpmBuild('broken', '1', '0', ['noarch'])
+        broken.add_requires('libfoo.so.4')
+        broken.add_requires('libbar')
+        self.addCleanup(shutil.rmtree, broken.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([libfoo4, broken])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+        libbar = rpmfluff.SimpleRpmBuild('libbar', '1', '0', ['noarch'])
+        libbar.make()
+        self.addCleanup(shutil.rmtree, libbar.get_base_dir())
+
+        # broken can be installed from the repos with libbar under test, so
+        # losing libfoo.so.4 is a new problem rather than a pre-existing one
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[libfoo5.get_built_rpm('noarch'),
+                          libbar.get_built_rpm('noarch')]) as da:
+            self.assertEqual(['package broken-1-0.noarch requires libfoo.so.4, '
+                    'but none of the providers can be installed'],
+                    da.find_repoclosure_problems())
+
+    def test_repoclosure_after_resetting_packages(self):
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, libfoo4.get_base_dir())
+        user = rpmfluff.SimpleRpmBuild('user', '1', '0', ['noarch'])
+        user.add_requires('libfoo.so.4')
+        self.addCleanup(shutil.rmtree, user.get_base_dir())
+        broken = rpmfluff.SimpleRpmBuild('broken', '1', '0', ['noarch'])
+        broken.add_requires('libfoo.so.4')
+        broken.add_requires('libbar')
+        self.addCleanup(shutil.rmtree, broken.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([libfoo4, user, broken])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+        libbar = rpmfluff.SimpleRpmBuild('libbar', '1', '0', ['noarch'])
+        libbar.make()
+        self.addCleanup(shutil.rmtree, libbar.get_base_dir())
+
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[libfoo5.get_built_rpm('noarch')]) as da:
+            # broken already cannot be installed, for want of libbar
+            self.assertEqual(['package user-1-0.noarch requires libfoo.so.4, '
+                    'but none of the providers can be installed'],
+                    da.find_repoclosure_problems())
+            da.reset_packages([libfoo5.get_built_rpm('noarch'),
+                    libbar.get_built_rpm('noarch')])
+            # Now libbar is under test, so the problem with broken is new
+            self.assertEqual([
+                    'package broken-1-0.noarch requires libfoo.so.4, '
+                        'but none of the providers can be installed',
+                    'package user-1-0.noarch requires libfoo.so.4, '
+                        'but none of the providers can be installed',
+                    ], sorted(da.find_repoclosure_problems()))
+
+    def test_repoclosure_in_worker_processes_matches_serial(self):
+        builds = []
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        builds.append(libfoo4)
+        for i in range(10):
+            user = rpmfluff.SimpleRpmBuild('user%d' % i, '1', '0', ['noarch'])
+            user.add_requires('libfoo.so.4')
+            if i % 3 == 0:
+                user.add_requires('doesnotexist')
+            builds.append(user)
+        for build in builds:
+            self.addCleanup(shutil.rmtree, build.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild(builds)
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+
+        results = []
+        for jobs in [1, 3]:
+            with DependencyAnalyzer(
+                    repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                    packages=[libfoo5.get_built_rpm('noarch')]) as da:
+                results.append(da.find_repoclosure_problems(full=True, jobs=jobs))
+        self.assertEqual(6, len(results[0]))
+        self.assertEqual(results[0], results[1])
+
+    def test_bulk_repoclosure_engine_finds_same_problems_as_single(self):
+        builds = []
+        libfoo4 = rpmfluff.SimpleRpmBuild('libfoo', '4.0', '1', ['noarch'])
+        libfoo4.add_provides('libfoo.so.4')
+        builds.append(libfoo4)
+        for i in range(6):
+            user = rpmfluff.SimpleRpmBuild('user%d' % i, '1', '0', ['noarch'])
+            user.add_requires('libfoo.so.4' if i % 2 else 'libfoo')
+            builds.append(user)
+        # These two can each be installed, but not together
+        for name, other in [('left', 'right'), ('right', 'left')]:
+            build = rpmfluff.SimpleRpmBuild(name, '1', '0', ['noarch'])
+            build.add_conflicts(other)
+            builds.append(build)
+        broken = rpmfluff.SimpleRpmBuild('broken', '1', '0', ['noarch'])
+        broken.add_requires('doesnotexist')
+        builds.append(broken)
+        for build in builds:
+            self.addCleanup(shutil.rmtree, build.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild(builds)
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        libfoo5 = rpmfluff.SimpleRpmBuild('libfoo', '5.0', '1', ['noarch'])
+        libfoo5.add_provides('libfoo.so.5')
+        libfoo5.make()
+        self.addCleanup(shutil.rmtree, libfoo5.get_base_dir())
+
+        results = []
+        for engine in ['single', 'bulk']:
+            with DependencyAnalyzer(
+                    repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                    packages=[libfoo5.get_built_rpm('noarch')]) as da:
+                results.append(da.find_repoclosure_problems(full=True, engine=engine))
+        self.assertEqual(['package user%d-1-0.noarch requires libfoo.so.4, '
+                'but none of the providers can be installed' % i for i in [1, 3, 5]],
+                sorted(results[0]))
+        self.assertEqual(results[0], results[1])
+
+    def test_obsoleted_packages_are_found_from_solvable_table(self):
+        builds = []
+        for version in ['1.0', '2.0', '3.0']:
+            builds.append(rpmfluff.SimpleRpmBuild('foo', version, '1', ['noarch']))
+        builds.append(rpmfluff.SimpleRpmBuild('oldname', '1', '0', ['noarch']))
+        builds.append(rpmfluff.SimpleRpmBuild('oldname', '3', '0', ['noarch']))
+        for build in builds:
+            self.addCleanup(shutil.rmtree, build.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild(builds)
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        foo = rpmfluff.SimpleRpmBuild('foo', '2.0', '1', ['noarch'])
+        foo.make()
+        self.addCleanup(shutil.rmtree, foo.get_base_dir())
+        newname = rpmfluff.SimpleRpmBuild('newname', '1', '0', ['noarch'])
+        newname.add_obsoletes('oldname < 2')
+        newname.make()
+        self.addCleanup(shutil.rmtree, newname.get_base_dir())
+
+        with DependencyAnalyzer(
+                repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                packages=[foo.get_built_rpm('noarch'),
+                          newname.get_built_rpm('noarch')]) as da:
+            table = da._solvable_table()
+            obsoleted = table.obsoleted_by(da.solvables)
+            self.assertEqual(['foo-1.0-1.noarch', 'oldname-1-0.noarch'],
+                    sorted(str(s) for s in obsoleted.solvables()))
+            existing = table.obsoleted_by(s for s in da.pool.solvables
+                    if s.repo != da.commandline_repo)
+            self.assertEqual(['foo-1.0-1.noarch', 'foo-2.0-1.noarch',
+                    'foo-2.0-1.noarch', 'oldname-1-0.noarch'],
+                    sorted(str(s) for s in existing.solvables()))
+            self.assertIn(da.solvables[0], existing)
+            self.assertNotIn(da.solvables[1], existing)
+
+    def test_targeted_upgrade_engine_finds_same_problems_as_distupgrade(self):
+        anaconda = rpmfluff.SimpleRpmBuild('anaconda', '19.31.123', '1.el7', ['noarch'])
+        anaconda.add_subpackage('user-help')
+        self.addCleanup(shutil.rmtree, anaconda.get_base_dir())
+        newname = rpmfluff.SimpleRpmBuild('newname', '1', '0', ['noarch'])
+        newname.add_obsoletes('oldname < 2')
+        self.addCleanup(shutil.rmtree, newname.get_base_dir())
+        unrelated = rpmfluff.SimpleRpmBuild('unrelated', '1', '0', ['noarch'])
+        self.addCleanup(shutil.rmtree, unrelated.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([anaconda, newname, unrelated])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        packages = []
+        for name, version in [('anaconda-user-help', '7.2.2'), ('oldname', '1'),
+                ('unrelated', '2')]:
+            build = rpmfluff.SimpleRpmBuild(name, version, '1', ['noarch'])
+            build.make()
+            self.addCleanup(shutil.rmtree, build.get_base_dir())
+            packages.append(build.get_built_rpm('noarch'))
+
+        results = []
+        for engine in ['distupgrade', 'targeted']:
+            with DependencyAnalyzer(
+                    repos=[Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                    packages=packages) as da:
+                results.append(da.find_upgrade_problems(engine=engine))
+        self.assertEqual([
+                'anaconda-user-help-7.2.2-1.noarch would be upgraded by '
+                    'anaconda-user-help-19.31.123-1.el7.noarch from repo base',
+                'oldname-1-1.noarch would be obsoleted by newname-1-0.noarch '
+                    'from repo base',
+                ], results[0])
+        self.assertEqual(results[0], results[1])
+
+    def test_analyzers_check_packages_in_turn_against_repo_set(self):
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_installed_file(installPath='usr/share/lemon/zest',
+                sourceFile=rpmfluff.SourceFile('zest', 'zesty\n'))
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('/usr/share/lemon/zest')
+        lemonade.make()
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+        pie = rpmfluff.SimpleRpmBuild('lemon-meringue-pie', '1', '0', ['noarch'])
+        pie.add_requires('lemonade')
+        pie.make()
+        self.addCleanup(shutil.rmtree, pie.get_base_dir())
+
+        with RepoSet([Repo(repo_name='base', baseurl=base_repo.repoDir)],
+                load_filelists=True) as repo_set:
+            # Nothing in the repos requires the file, so it is only 
+            # provided once the package under test is added.
+            with DependencyAnalyzer(repo_set, [lemonade.get_built_rpm('noarch')]) as da:
+                self.assertRaises(RuntimeError, DependencyAnalyzer,
+                        repo_set, [pie.get_built_rpm('noarch')])
+                ok, dependency_set = da.try_to_install_all()
+                self.assertEqual(True, ok)
+                self.assertEqual(['lemon-1-3.noarch'],
+                        dependency_set.package_dependencies['lemonade-1-0.noarch']['dependencies'])
+            # The previous package under test is gone
+            with DependencyAnalyzer(repo_set, [pie.get_built_rpm('noarch')]) as da:
+                ok, dependency_set = da.try_to_install_all()
+                self.assertEqual(False, ok)
+                self.assertEqual(['base'], sorted(da.repos_by_name))
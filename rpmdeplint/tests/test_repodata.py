@@ -5,9 +5,12 @@
 # (at your option) any later version.
 
 import os
+import time
+import hashlib
 import platform
 import pytest
-from rpmdeplint.repodata import Repo, RepoDownloadError, get_yumvars
+from rpmdeplint.repodata import Repo, RepoDownloadError, get_yumvars, \
+        parse_metadata_expire, parse_size, CacheIndex
 
 
 @pytest.fixture
@@ -119,3 +122,119 @@ def test_skip_if_unavailable_is_obeyed(yumdir):
     assert len(repos) == 1
     assert repos[0].name == 'dummy'
     assert repos[0].skip_if_unavailable == True
+
+
+def test_loads_metadata_expire_from_system_yum_config(yumdir):
+    yumdir.join('yum.conf').write('[main]\nmetadata_expire=6h\n')
+    yumdir.join('yum.repos.d', 'dummy.repo').write(
+            '[dummy]\nname=Dummy\nbaseurl=http://example.invalid/dummy\n'
+            '[other]\nname=Other\nbaseurl=http://example.invalid/other\nmetadata_expire=never\n',
+            ensure=True)
+
+    repos = dict((repo.name, repo) for repo in Repo.from_yum_config())
+    assert repos['dummy'].metadata_expire == 6 * 60 * 60
+    assert repos['other'].metadata_expire == float('inf')
+
+
+def test_parse_metadata_expire():
+    assert parse_metadata_expire('0') == 0
+    assert parse_metadata_expire('90') == 90
+    assert parse_metadata_expire('90m') == 90 * 60
+    assert parse_metadata_expire('2d') == 2 * 24 * 60 * 60
+    assert parse_metadata_expire('-1') == float('inf')
+    assert parse_metadata_expire('never') == float('inf')
+    with pytest.raises(ValueError):
+        parse_metadata_expire('soon')
+
+
+def test_parse_size():
+    assert parse_size('1000') == 1000
+    assert parse_size('4K') == 4096
+    assert parse_size('1.5M') == 1536 * 1024
+    assert parse_size('2GB') == 2 * 1024 ** 3
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def write_cache_entry(index, content, kind='repodata', last_used=None):
+    checksum = hashlib.sha256(content).hexdigest()
+    path = os.path.join(index.base_path, checksum[:1], checksum[1:])
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    index.record(path, kind)
+    if last_used is not None:
+        with index._db:
+            index._db.execute('UPDATE entries SET last_used = ? WHERE path = ?',
+                    (last_used, os.path.relpath(path, index.base_path)))
+    return path
+
+
+def test_cache_prune_evicts_least_recently_used_entries(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    now = time.time()
+    oldest = write_cache_entry(index, b'a' * 100, last_used=now - 30)
+    older = write_cache_entry(index, b'b' * 100, last_used=now - 20)
+    newest = write_cache_entry(index, b'c' * 100, last_used=now - 10)
+
+    assert index.prune(expiry_seconds=3600, size_budget=150) == 2
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(older)
+    assert os.path.exists(newest)
+    assert [path for path, size, last_used, kind in index.entries()] == [newest]
+
+
+def test_cache_prune_removes_expired_entries(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    now = time.time()
+    expired = write_cache_entry(index, b'a', last_used=now - 7200)
+    fresh = write_cache_entry(index, b'b', last_used=now)
+
+    assert index.prune(expiry_seconds=3600) == 1
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh)
+
+
+def test_cache_removes_expired_unrecorded_files(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    recorded = write_cache_entry(index, b'a')
+    os.utime(recorded, (0, 0))
+    expired = str(tmpdir.join('b', 'tmpexpired'))
+    tmpdir.join('b', 'tmpexpired').write('partial', ensure=True)
+    os.utime(expired, (0, 0))
+    fresh = str(tmpdir.join('b', 'tmpfresh'))
+    tmpdir.join('b', 'tmpfresh').write('partial', ensure=True)
+
+    assert index.remove_unrecorded(expiry_seconds=3600) == 1
+    assert not os.path.exists(expired)
+    assert os.path.exists(fresh)
+    # Recorded entries are expired by prune() according to their last use
+    assert os.path.exists(recorded)
+
+
+def test_cache_index_adopts_existing_files(tmpdir):
+    tmpdir.join('a', 'bcdef').write('content', ensure=True)
+    index = CacheIndex(str(tmpdir))
+    assert [(path, kind) for path, size, last_used, kind in index.entries()] == \
+            [(str(tmpdir.join('a', 'bcdef')), 'unknown')]
+
+
+def test_cache_verify_removes_corrupted_entries(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    good = write_cache_entry(index, b'good')
+    bad = write_cache_entry(index, b'bad')
+    with open(bad, 'wb') as f:
+        f.write(b'corrupted')
+
+    assert index.verify() == [bad]
+    assert os.path.exists(good)
+    assert not os.path.exists(bad)
+
+
+def test_cache_verify_skips_entries_removed_concurrently(tmpdir):
+    index = CacheIndex(str(tmpdir))
+    removed = write_cache_entry(index, b'removed')
+    os.unlink(removed)
+
+    assert index.verify() == []
@@ -0,0 +1,113 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+import os
+import json
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+from argparse import Namespace
+from unittest import TestCase
+from rpmdeplint.repodata import Repo
+from rpmdeplint.server import CheckServer
+import rpmfluff
+
+
+class TestCheckServer(TestCase):
+
+    def start_server(self, repos, **kwargs):
+        socket_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, socket_dir)
+        defaults = Namespace(repos=repos, repos_from_system=False, arch=None,
+                max_parallel_downloads=4, metadata_expire=None,
+                full_repoclosure=False, jobs=1, repoclosure_engine='bulk',
+                upgrade_engine='targeted')
+        server = CheckServer(os.path.join(socket_dir, 'socket'), defaults, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        return server
+
+    def send_requests(self, server, requests):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(server.socket_path)
+        f = sock.makefile('rwb')
+        try:
+            responses = []
+            for request in requests:
+                f.write(json.dumps(request).encode('utf8') + b'\n')
+                f.flush()
+                responses.append(json.loads(f.readline().decode('utf8')))
+        finally:
+            f.close()
+            sock.close()
+        return responses
+
+    def test_checks_packages_against_loaded_repos(self):
+        lemon = rpmfluff.SimpleRpmBuild('lemon', '1', '3', ['noarch'])
+        lemon.add_provides('lemon-juice')
+        self.addCleanup(shutil.rmtree, lemon.get_base_dir())
+        base_repo = rpmfluff.YumRepoBuild([lemon])
+        base_repo.make('noarch')
+        self.addCleanup(shutil.rmtree, base_repo.repoDir)
+
+        lemonade = rpmfluff.SimpleRpmBuild('lemonade', '1', '0', ['noarch'])
+        lemonade.add_requires('lemon-juice')
+        lemonade.make()
+        self.addCleanup(shutil.rmtree, lemonade.get_base_dir())
+        pie = rpmfluff.SimpleRpmBuild('lemon-meringue-pie', '1', '0', ['noarch'])
+        pie.add_requires('lemon-juice')
+        pie.add_requires('egg-whites')
+        pie.make()
+        self.addCleanup(shutil.rmtree, pie.get_base_dir())
+        old_lemon = rpmfluff.SimpleRpmBuild('lemon', '0.9', '1', ['noarch'])
+        old_lemon.make()
+        self.addCleanup(shutil.rmtree, old_lemon.get_base_dir())
+
+        server = self.start_server([Repo(repo_name='base', baseurl=base_repo.repoDir)])
+        responses = self.send_requests(server, [
+            {'rpms': [pie.get_built_rpm('noarch')], 'checks': ['check-sat']},
+            {'rpms': [lemonade.get_built_rpm('noarch')]},
+            {'rpms': [old_lemon.get_built_rpm('noarch')], 'checks': ['check-upgrade']},
+            {'rpms': ['/does/not/exist.rpm']},
+            {'checks': ['check-sat']},
+        ])
+        self.assertEqual({'status': 3, 'problems': {'check-sat': [
+                'nothing provides egg-whites needed by lemon-meringue-pie-1-0.noarch']}},
+                responses[0])
+        # The package from the previous request is gone
+        self.assertEqual({'status': 0, 'problems': {'check-sat': [],
+                'check-repoclosure': [], 'check-conflicts': [], 'check-upgrade': []}},
+                responses[1])
+        self.assertEqual({'status': 3, 'problems': {'check-upgrade': [
+                'lemon-0.9-1.noarch would be upgraded by lemon-1-3.noarch from repo base']}},
+                responses[2])
+        self.assertEqual(1, responses[3]['status'])
+        self.assertIn('/does/not/exist.rpm', responses[3]['error'])
+        self.assertEqual(1, responses[4]['status'])
+        self.assertIn('rpms', responses[4]['error'])
+        # The repos were only loaded once
+        self.assertEqual(1, len(server._repo_sets))
+
+    def test_socket_is_only_accessible_by_owner(self):
+        server = self.start_server([])
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(server.socket_path).st_mode))
+
+    def test_idle_connection_does_not_hold_up_other_clients(self):
+        server = self.start_server([], connection_timeout=0.5)
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(server.socket_path)
+        self.addCleanup(idle.close)
+        responses = self.send_requests(server, [{'checks': ['check-sat']}])
+        self.assertEqual(1, responses[0]['status'])
+        self.assertIn('rpms', responses[0]['error'])
+        # The server has closed the idle connection
+        self.assertEqual(b'', idle.recv(1))